@@ -0,0 +1,43 @@
+import json
+from datetime import date, datetime, timezone
+
+from flask import Response, request
+
+from fleet_state import fleet_state
+
+# Respuestas JSON para clientes que consultan periódicamente (tabletas, pantalla
+# del estacionamiento). El ETag y Last-Modified se derivan del contador de
+# cambios de la flota: si nada cambió se responde 304 sin más consultas que la
+# lectura de la versión.
+
+
+def _json_default(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    raise TypeError(f'{type(value).__name__} no es serializable')
+
+
+def fleet_json_response(scope, build):
+    # `scope` distingue el recurso y el usuario (forma parte del ETag);
+    # `build(version)` sólo se llama si el cliente no tiene la versión actual.
+    version, updated_at = fleet_state()
+    etag = f'fleet-{version}-{scope}'
+    # updated_at se guarda en hora local sin zona; HTTP exige GMT
+    last_modified = updated_at.replace(microsecond=0).astimezone(timezone.utc) if updated_at else None
+
+    not_modified = request.if_none_match.contains(etag) if request.if_none_match else (
+        last_modified is not None and request.if_modified_since is not None
+        and last_modified <= request.if_modified_since
+    )
+    if not_modified:
+        response = Response(status=304)
+    else:
+        body = json.dumps({'version': version, 'data': build(version)},
+                          default=_json_default, ensure_ascii=False, sort_keys=True)
+        response = Response(body, mimetype='application/json')
+    response.set_etag(etag)
+    if last_modified:
+        response.last_modified = last_modified
+    # El cliente debe revalidar siempre; la respuesta depende del usuario
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
@@ -1,24 +1,62 @@
-from flask import Flask, render_template, request, redirect, url_for, flash
+import click
+from flask import Flask, render_template, request, redirect, url_for, flash, abort, jsonify, Response, send_file, stream_with_context
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import LoginManager, UserMixin, login_user, login_required, logout_user, current_user
 from werkzeug.security import generate_password_hash
-from datetime import datetime
+from datetime import datetime, timedelta
+import calendar
+from itertools import islice
+import os
+import re
+import tempfile
 from sqlalchemy.orm import joinedload
 
-from config import Config
-from models import db, User, Vehicle, Trip, Request, VehicleLog, IncidentReport
+from config import get_config
+from models import db, configure_engine, User, Vehicle, Trip, Request, VehicleLog, IncidentReport, ArchivedTrip, ArchivedVehicleLog
+from archive import archive_history, archive_cutoff, merged_keyset_page
+from backfill import backfill_trip_requests
+from audit import audit_writer, log_event
+from auth import user_cache, password_hasher, LoginBusy
+from events import init_events, publish_event, event_stream
+from api import fleet_json_response
+from instrumentation import instrumentation
+from fleet_state import bump_fleet_version
+from snapshots import snapshot_cache
+from reservations import (approve, reject, process_batch, start_reservation, with_retries, parse_window, starts_later,
+                          is_reserved, free_vehicles_query, overlapping_requests, RequestAlreadyProcessed,
+                          VehicleUnavailable, VehicleReserved, OutsideReservationWindow)
+from benchmark import run_benchmarks
+from fleetgen import generate_fleet
+from migrations import upgrade_database
+from query_plans import check_query_plans
+from pagination import decode_cursor, keyset_page
+from rollups import record_trip_usage, rebuild_rollups, parse_period, fleet_statistics
+from vehicle_import import iter_import_rows, import_vehicles, ImportFileError
+from search import search, KIND_LABELS
+from reports import (parse_report_filters, view_filters, iter_report_rows, iter_report_csv, write_report_xlsx,
+                     report_filename, REPORT_VIEW_LIMIT)
+from report_jobs import report_jobs, format_available, ReportQueueFull, REPORT_FORMATS
 
 app = Flask(__name__)
-app.config.from_object(Config)
+app.config.from_object(get_config())
 db.init_app(app)
+configure_engine(app)
 
 login_manager = LoginManager()
 login_manager.init_app(app)
 login_manager.login_view = 'login'
 
+snapshot_cache.init_app(app)
+audit_writer.init_app(app)
+instrumentation.init_app(app)
+fleet_events = init_events(app)
+user_cache.init_app(app)
+password_hasher.init_app(app)
+report_jobs.init_app(app)
+
 @login_manager.user_loader
 def load_user(user_id):
-    return db.session.get(User, int(user_id))
+    return user_cache.load(int(user_id))
 
 # Rutas de autenticación
 @app.route('/login', methods=['GET', 'POST'])
@@ -26,10 +64,18 @@ def login():
     if current_user.is_authenticated:
         return redirect(url_for('dashboard'))
     if request.method == 'POST':
+        password = request.form['password']
         user = User.query.filter_by(username=request.form['username']).first()
-        if user and user.check_password(request.form['password']):
-            login_user(user)
-            return redirect(url_for('dashboard'))
+        try:
+            if user and password_hasher.verify(user.password_hash, password):
+                if password_hasher.needs_rehash(user.password_hash):
+                    user.password_hash = password_hasher.hash(password)
+                    db.session.commit()
+                login_user(user_cache.remember(user))
+                return redirect(url_for('dashboard'))
+        except LoginBusy:
+            flash('Hay demasiados inicios de sesión en este momento. Intenta de nuevo en unos segundos.')
+            return render_template('login.html'), 503
         flash('Usuario o contraseña incorrectos.')
     return render_template('login.html')
 
@@ -49,15 +95,56 @@ def index():
 @login_required
 def dashboard():
     if current_user.role == 'admin':
-        pending_requests = Request.query.filter_by(status='pending').all()
-        active_trips = Trip.query.filter(Trip.end_time.is_(None)).all()
-        all_vehicles = Vehicle.query.all()
-        pending_incidents = IncidentReport.query.filter_by(status='pending').all()
-        return render_template('dashboard.html', user=current_user, requests=pending_requests, active_trips=active_trips, all_vehicles=all_vehicles, pending_incidents=pending_incidents)
+        return render_template('dashboard.html', user=current_user, **snapshot_cache.admin())
     else:  # Trabajador
-        available_vehicles = Vehicle.query.filter_by(status='available').all()
-        my_requests = Request.query.filter_by(user_id=current_user.id).order_by(Request.date_requested.desc()).all()
-        return render_template('dashboard.html', user=current_user, vehicles=available_vehicles, my_requests=my_requests)
+        return render_template('dashboard.html', user=current_user, **snapshot_cache.worker(current_user.id))
+
+# API JSON con GET condicional (ETag/Last-Modified) para clientes que consultan periódicamente
+@app.route('/api/vehicles')
+@login_required
+def api_vehicles():
+    if current_user.role == 'admin':
+        def build(version):
+            snapshot = snapshot_cache.admin(version)
+            return {'vehicles': snapshot['all_vehicles'], 'status_counts': snapshot['status_counts']}
+        return fleet_json_response('vehicles-admin', build)
+    return fleet_json_response('vehicles-available', lambda version: {
+        'vehicles': snapshot_cache.worker(current_user.id, version)['vehicles'],
+    })
+
+@app.route('/api/requests/pending')
+@login_required
+def api_pending_requests():
+    if current_user.role != 'admin':
+        abort(403)
+    return fleet_json_response('requests-pending', lambda version: {
+        'requests': snapshot_cache.admin(version)['requests'],
+    })
+
+@app.route('/api/requests/mine')
+@login_required
+def api_my_requests():
+    return fleet_json_response(f'requests-user{current_user.id}', lambda version: {
+        'requests': snapshot_cache.worker(current_user.id, version)['my_requests'],
+    })
+
+@app.route('/api/trips/active')
+@login_required
+def api_active_trips():
+    if current_user.role != 'admin':
+        abort(403)
+    return fleet_json_response('trips-active', lambda version: {
+        'trips': snapshot_cache.admin(version)['active_trips'],
+    })
+
+@app.route('/api/incidents/pending')
+@login_required
+def api_pending_incidents():
+    if current_user.role != 'admin':
+        abort(403)
+    return fleet_json_response('incidents-pending', lambda version: {
+        'incidents': snapshot_cache.admin(version)['pending_incidents'],
+    })
 
 @app.route('/add_vehicle', methods=['POST'])
 @login_required
@@ -81,14 +168,42 @@ def add_vehicle():
                 current_odometer=current_odometer
             )
             db.session.add(new_vehicle)
+            db.session.flush()
+            log_event(new_vehicle.id, 'Creado', 'Vehículo añadido al sistema.')
+            publish_event('vehicle_added', vehicle_id=new_vehicle.id, status=new_vehicle.status)
+            bump_fleet_version()
             db.session.commit()
             flash('Vehículo añadido exitosamente.', 'success')
-            log_event(new_vehicle.id, 'Creado', 'Vehículo añadido al sistema.')
     except Exception as e:
         db.session.rollback()
         flash(f'Error al añadir vehículo: {e}', 'danger')
     return redirect(url_for('dashboard'))
 
+@app.route('/import_vehicles', methods=['GET', 'POST'])
+@login_required
+def import_vehicles_view():
+    if current_user.role != 'admin':
+        flash('Solo los administradores pueden importar vehículos.', 'danger')
+        return redirect(url_for('dashboard'))
+
+    result = None
+    if request.method == 'POST':
+        upload = request.files.get('file')
+        if not upload or not upload.filename:
+            flash('Selecciona un archivo CSV o XLSX.', 'warning')
+            return redirect(url_for('import_vehicles_view'))
+        try:
+            result = import_vehicles(iter_import_rows(upload.stream, upload.filename))
+            flash(f"Importación terminada: {result['created']} vehículos creados, "
+                  f"{len(result['errors'])} filas con error.", 'success' if result['created'] else 'warning')
+        except ImportFileError as e:
+            flash(str(e), 'danger')
+        except ImportError:
+            flash('La importación de XLSX requiere el paquete openpyxl.', 'warning')
+        except Exception as e:
+            flash(f'Error al importar vehículos: {e}', 'danger')
+    return render_template('import_vehicles.html', result=result)
+
 @app.route('/request_vehicle', methods=['POST'])
 @login_required
 def request_vehicle():
@@ -103,11 +218,21 @@ def request_vehicle():
         num_auditors = request.form['num_auditors']
         auditors_names = request.form['auditors_names']
         reason = request.form['reason']
+        try:
+            start_time, end_time = parse_window(request.form)
+        except ValueError as e:
+            flash(str(e), 'warning')
+            return redirect(url_for('dashboard'))
 
-        vehicle = Vehicle.query.get(vehicle_id)
-        if vehicle.status != 'available':
+        vehicle = db.session.get(Vehicle, int(vehicle_id))
+        # Las reservas futuras sólo requieren que el horario esté libre
+        if not vehicle or (not starts_later(start_time) and vehicle.status != 'available'):
             flash('Este vehículo no está disponible para ser solicitado.', 'warning')
             return redirect(url_for('dashboard'))
+        now = datetime.now()
+        if is_reserved(vehicle.id, start_time or now, end_time or now + timedelta(minutes=1)):
+            flash('El vehículo ya está reservado en ese horario.', 'warning')
+            return redirect(url_for('dashboard'))
 
         new_request = Request(
             user_id=current_user.id,
@@ -116,9 +241,14 @@ def request_vehicle():
             reason=reason,
             responsible_name=responsible_name,
             num_auditors=num_auditors,
-            auditors_names=auditors_names
+            auditors_names=auditors_names,
+            start_time=start_time,
+            end_time=end_time
         )
         db.session.add(new_request)
+        db.session.flush()
+        publish_event('request_created', request_id=new_request.id, vehicle_id=vehicle.id, user_id=current_user.id)
+        bump_fleet_version()
         db.session.commit()
         flash('Solicitud enviada exitosamente. Esperando aprobación del administrador.', 'success')
     except Exception as e:
@@ -133,34 +263,82 @@ def approve_request(request_id):
         flash('No tienes permiso para aprobar solicitudes.', 'danger')
         return redirect(url_for('dashboard'))
 
-    req = db.session.get(Request, request_id)
-    if req and req.status == 'pending':
-        try:
-            req.status = 'approved'
-
-            new_trip = Trip(
-                user_id=req.user_id,
-                vehicle_id=req.vehicle_id,
-                destination=req.destination,
-                reason=req.reason,
-                start_time=datetime.now(),
-                start_odometer=req.vehicle.current_odometer
-            )
-
-            vehicle = req.vehicle
-            vehicle.status = 'in_use'
-
-            db.session.add(new_trip)
-            db.session.commit()
+    try:
+        if with_retries(lambda: approve(request_id)):
             flash('Solicitud aprobada y viaje registrado. El vehículo está en uso.', 'success')
-            log_event(vehicle.id, 'En uso', f'Asignado a {req.user.username} para viaje a {req.destination}')
-        except Exception as e:
-            db.session.rollback()
-            flash(f'Error al aprobar la solicitud: {e}', 'danger')
-    else:
+        else:
+            flash('Reserva aprobada. El viaje se inicia cuando llegue el horario reservado.', 'success')
+    except RequestAlreadyProcessed:
         flash('La solicitud no existe o ya ha sido procesada.', 'warning')
+    except VehicleUnavailable:
+        flash('El vehículo ya no está disponible; la solicitud sigue pendiente.', 'warning')
+    except VehicleReserved:
+        flash('El vehículo tiene otra reserva aprobada en ese horario; la solicitud sigue pendiente.', 'warning')
+    except Exception as e:
+        db.session.rollback()
+        flash(f'Error al aprobar la solicitud: {e}', 'danger')
+    return redirect(url_for('dashboard'))
+
+@app.route('/start_reservation/<int:request_id>', methods=['POST'])
+@login_required
+def start_reservation_view(request_id):
+    if current_user.role != 'admin':
+        flash('No tienes permiso para iniciar viajes.', 'danger')
+        return redirect(url_for('dashboard'))
+
+    try:
+        with_retries(lambda: start_reservation(request_id))
+        flash('Viaje iniciado. El vehículo está en uso.', 'success')
+    except RequestAlreadyProcessed:
+        flash('La reserva no existe o su viaje ya fue iniciado.', 'warning')
+    except OutsideReservationWindow:
+        flash('La reserva todavía no empieza o ya terminó.', 'warning')
+    except VehicleUnavailable:
+        flash('El vehículo no está disponible en este momento.', 'warning')
+    except Exception as e:
+        db.session.rollback()
+        flash(f'Error al iniciar el viaje: {e}', 'danger')
     return redirect(url_for('dashboard'))
 
+@app.route('/availability')
+@login_required
+def availability():
+    # Vehículos libres para un horario; los trabajadores pueden reservar desde aquí
+    try:
+        start_time, end_time = parse_window(request.args)
+    except ValueError as e:
+        flash(str(e), 'warning')
+        return redirect(url_for('availability'))
+    vehicles = free_vehicles_query(start_time, end_time).all() if start_time else []
+    return render_template('availability.html', vehicles=vehicles, start_time=start_time, end_time=end_time)
+
+@app.route('/vehicle_calendar/<int:vehicle_id>')
+@login_required
+def vehicle_calendar(vehicle_id):
+    vehicle = db.session.get(Vehicle, vehicle_id)
+    if not vehicle:
+        flash('Vehículo no encontrado.', 'warning')
+        return redirect(url_for('dashboard'))
+    try:
+        month = datetime.strptime(request.args['mes'], '%Y-%m') if request.args.get('mes') \
+            else datetime.now().replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+    except ValueError:
+        flash('El mes indicado no es válido.', 'warning')
+        return redirect(url_for('vehicle_calendar', vehicle_id=vehicle_id))
+    next_month = (month + timedelta(days=32)).replace(day=1)
+    reservations = overlapping_requests(vehicle_id, month, next_month, statuses=('approved', 'pending')) \
+        .options(db.joinedload(Request.user)).all()
+    weeks = calendar.Calendar().monthdatescalendar(month.year, month.month)
+    days = {}
+    for reservation in reservations:
+        day = max(reservation.start_time.date(), weeks[0][0])
+        while day <= min(reservation.end_time.date(), weeks[-1][-1]):
+            days.setdefault(day, []).append(reservation)
+            day += timedelta(days=1)
+    return render_template('vehicle_calendar.html', vehicle=vehicle, month=month, weeks=weeks, days=days,
+                           previous_month=(month - timedelta(days=1)).strftime('%Y-%m'),
+                           next_month=next_month.strftime('%Y-%m'))
+
 @app.route('/reject_request/<int:request_id>')
 @login_required
 def reject_request(request_id):
@@ -168,19 +346,40 @@ def reject_request(request_id):
         flash('No tienes permiso para rechazar solicitudes.', 'danger')
         return redirect(url_for('dashboard'))
 
-    req = db.session.get(Request, request_id)
-    if req and req.status == 'pending':
-        try:
-            req.status = 'rejected'
-            db.session.commit()
-            flash('Solicitud rechazada.', 'success')
-        except Exception as e:
-            db.session.rollback()
-            flash(f'Error al rechazar la solicitud: {e}', 'danger')
-    else:
+    try:
+        with_retries(lambda: reject(request_id))
+        flash('Solicitud rechazada.', 'success')
+    except RequestAlreadyProcessed:
         flash('La solicitud no existe o ya ha sido procesada.', 'warning')
+    except Exception as e:
+        db.session.rollback()
+        flash(f'Error al rechazar la solicitud: {e}', 'danger')
     return redirect(url_for('dashboard'))
 
+@app.route('/process_requests', methods=['POST'])
+@login_required
+def process_requests():
+    if current_user.role != 'admin':
+        flash('No tienes permiso para procesar solicitudes.', 'danger')
+        return redirect(url_for('dashboard'))
+
+    action = request.form.get('action')
+    try:
+        request_ids = [int(value) for value in request.form.getlist('request_ids')]
+    except ValueError:
+        abort(400)
+    if action not in ('approve', 'reject') or not request_ids:
+        flash('Selecciona al menos una solicitud y una acción.', 'warning')
+        return redirect(url_for('dashboard'))
+
+    try:
+        results = with_retries(lambda: process_batch(request_ids, action))
+    except Exception as e:
+        db.session.rollback()
+        flash(f'Error al procesar las solicitudes: {e}', 'danger')
+        return redirect(url_for('dashboard'))
+    return render_template('batch_results.html', action=action, results=results)
+
 @app.route('/complete_trip/<int:trip_id>', methods=['GET', 'POST'])
 @login_required
 def complete_trip(trip_id):
@@ -208,9 +407,19 @@ def complete_trip(trip_id):
             vehicle.status = 'available'
             vehicle.current_odometer = end_odometer
 
+            # Si regresó antes de lo reservado, el resto del horario queda libre
+            reservation = trip.request
+            if reservation and reservation.end_time and reservation.end_time > trip.end_time:
+                reservation.end_time = max(trip.end_time, reservation.start_time)
+
+            record_trip_usage(trip)
+
+            log_event(vehicle.id, 'Disponible', f'Viaje completado por {trip.user.username}. Kilómetros recorridos: {trip.km_traveled}')
+            publish_event('trip_completed', trip_id=trip.id, vehicle_id=vehicle.id, status=vehicle.status,
+                          km_traveled=trip.km_traveled)
+            bump_fleet_version()
             db.session.commit()
             flash('Viaje completado y vehículo marcado como disponible.', 'success')
-            log_event(vehicle.id, 'Disponible', f'Viaje completado por {trip.user.username}. Kilómetros recorridos: {trip.km_traveled}')
             return redirect(url_for('dashboard'))
         except Exception as e:
             db.session.rollback()
@@ -226,33 +435,155 @@ def report():
         flash('No tienes permiso para ver los reportes.', 'danger')
         return redirect(url_for('dashboard'))
 
-    trips = Trip.query.filter(Trip.end_time.isnot(None)).options(db.joinedload(Trip.user), db.joinedload(Trip.vehicle)).all()
-    requests_map = { (req.user_id, req.vehicle_id, req.destination): req for req in Request.query.all() }
-
-    report_data = []
-    for trip in trips:
-        # Usar un enfoque más robusto para encontrar la solicitud
-        request_for_trip = requests_map.get((trip.user_id, trip.vehicle_id, trip.destination))
-        
-        data = {
-            'fecha_salida': trip.start_time.strftime('%d/%m/%Y %H:%M:%S'),
-            'fecha_regreso': trip.end_time.strftime('%d/%m/%Y %H:%M:%S') if trip.end_time else 'N/A',
-            'resguardante': trip.user.username,
-            'placa': trip.vehicle.license_plate,
-            'marca': trip.vehicle.make,
-            'modelo': trip.vehicle.model,
-            'odometro_inicio': trip.start_odometer,
-            'odometro_fin': trip.end_odometer,
-            'km_recorridos': trip.km_traveled,
-            'responsable': request_for_trip.responsible_name if request_for_trip else 'N/A',
-            'no_auditores': request_for_trip.num_auditors if request_for_trip else 'N/A',
-            'nombre_auditores': request_for_trip.auditors_names if request_for_trip else 'N/A',
-            'ruta_destino': trip.destination,
-            'motivo_salida': trip.reason
-        }
-        report_data.append(data)
-
-    return render_template('report.html', report_data=report_data)
+    try:
+        filters = parse_report_filters(request.args)
+    except ValueError:
+        flash('Los filtros del reporte no son válidos.', 'warning')
+        return redirect(url_for('report'))
+
+    shown = view_filters(filters)
+    report_data = list(islice(iter_report_rows(shown), REPORT_VIEW_LIMIT + 1))
+    truncated = len(report_data) > REPORT_VIEW_LIMIT
+    vehicles = Vehicle.query.order_by(Vehicle.license_plate).all()
+    return render_template('report.html', report_data=report_data[:REPORT_VIEW_LIMIT], truncated=truncated,
+                           filters=shown, limit=REPORT_VIEW_LIMIT, vehicles=vehicles)
+
+@app.route('/report.csv')
+@login_required
+def report_csv():
+    if current_user.role != 'admin':
+        flash('No tienes permiso para ver los reportes.', 'danger')
+        return redirect(url_for('dashboard'))
+
+    try:
+        filters = parse_report_filters(request.args)
+    except ValueError:
+        flash('Los filtros del reporte no son válidos.', 'warning')
+        return redirect(url_for('report'))
+
+    response = Response(stream_with_context(iter_report_csv(filters)), mimetype='text/csv; charset=utf-8')
+    response.headers['Content-Disposition'] = f'attachment; filename={report_filename(filters, "csv")}'
+    return response
+
+@app.route('/report.xlsx')
+@login_required
+def report_xlsx():
+    if current_user.role != 'admin':
+        flash('No tienes permiso para ver los reportes.', 'danger')
+        return redirect(url_for('dashboard'))
+
+    try:
+        filters = parse_report_filters(request.args)
+    except ValueError:
+        flash('Los filtros del reporte no son válidos.', 'warning')
+        return redirect(url_for('report'))
+
+    # El formato XLSX es un zip: se escribe en un archivo temporal y se envía por bloques
+    output = tempfile.TemporaryFile()
+    try:
+        write_report_xlsx(filters, output)
+    except ImportError:
+        output.close()
+        flash('La exportación a XLSX requiere el paquete openpyxl.', 'warning')
+        return redirect(url_for('report'))
+    output.seek(0)
+    return send_file(
+        output,
+        mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+        as_attachment=True,
+        download_name=report_filename(filters, 'xlsx')
+    )
+
+@app.route('/report_jobs', methods=['POST'])
+@login_required
+def create_report_job():
+    # Encola la generación del reporte; si ya existe para los mismos filtros
+    # y la misma versión de la flota se descarga de inmediato
+    if current_user.role != 'admin':
+        flash('No tienes permiso para ver los reportes.', 'danger')
+        return redirect(url_for('dashboard'))
+
+    try:
+        filters = parse_report_filters(request.form)
+    except ValueError:
+        flash('Los filtros del reporte no son válidos.', 'warning')
+        return redirect(url_for('report'))
+    fmt = request.form.get('formato', 'csv')
+    if fmt not in REPORT_FORMATS:
+        abort(400)
+    if not format_available(fmt):
+        flash(f'La exportación a {fmt.upper()} requiere el paquete {REPORT_FORMATS[fmt][1]}.', 'warning')
+        return redirect(url_for('report'))
+
+    try:
+        key = report_jobs.submit(filters, fmt)
+    except ReportQueueFull:
+        flash('Hay demasiados reportes en preparación. Intenta de nuevo en unos minutos.', 'warning')
+        return redirect(url_for('report'))
+    if report_jobs.status(key)['state'] == 'ready':
+        return redirect(url_for('download_report_job', key=key))
+    return redirect(url_for('report_job', key=key))
+
+def _report_job_status(key):
+    if current_user.role != 'admin':
+        abort(403)
+    status = report_jobs.status(key) if re.fullmatch(r'[0-9a-f]{64}', key) else None
+    if status is None:
+        abort(404)
+    return status
+
+@app.route('/report_jobs/<key>')
+@login_required
+def report_job(key):
+    return render_template('report_job.html', job=_report_job_status(key))
+
+@app.route('/api/report_jobs/<key>')
+@login_required
+def report_job_api(key):
+    status = _report_job_status(key)
+    status['requested_at'] = status['requested_at'].isoformat()
+    status['download_url'] = url_for('download_report_job', key=key) if status['state'] == 'ready' else None
+    return jsonify(status)
+
+@app.route('/report_jobs/<key>/download')
+@login_required
+def download_report_job(key):
+    _report_job_status(key)
+    path, meta = report_jobs.result_path(key)
+    if path is None:
+        flash('El reporte todavía no está listo.', 'warning')
+        return redirect(url_for('report_job', key=key))
+    os.utime(path)
+    return send_file(path, mimetype=REPORT_FORMATS[meta['formato']][0], as_attachment=True,
+                     download_name=meta['filename'])
+
+@app.route('/statistics')
+@login_required
+def statistics():
+    if current_user.role != 'admin':
+        flash('No tienes permiso para ver las estadísticas.', 'danger')
+        return redirect(url_for('dashboard'))
+
+    try:
+        desde, hasta = parse_period(request.args)
+    except ValueError:
+        flash('El periodo indicado no es válido.', 'warning')
+        return redirect(url_for('statistics'))
+
+    return render_template('statistics.html', stats=fleet_statistics(desde, hasta))
+
+@app.route('/api/statistics')
+@login_required
+def api_statistics():
+    if current_user.role != 'admin':
+        abort(403)
+
+    try:
+        desde, hasta = parse_period(request.args)
+    except ValueError:
+        abort(400)
+
+    return jsonify(fleet_statistics(desde, hasta))
 
 @app.route('/vehicle_details/<int:vehicle_id>')
 @login_required
@@ -266,10 +597,27 @@ def vehicle_details(vehicle_id):
         flash('Vehículo no encontrado.', 'warning')
         return redirect(url_for('dashboard'))
 
-    trips = Trip.query.filter_by(vehicle_id=vehicle_id).order_by(Trip.start_time.desc()).all()
-    logs = VehicleLog.query.filter_by(vehicle_id=vehicle_id).order_by(VehicleLog.timestamp.desc()).all()
-
-    return render_template('vehicle_details.html', vehicle=vehicle, trips=trips, logs=logs)
+    try:
+        trips_cursor = decode_cursor(request.args.get('trips_cursor'))
+        logs_cursor = decode_cursor(request.args.get('logs_cursor'))
+    except ValueError:
+        flash('La página solicitada no es válida.', 'warning')
+        return redirect(url_for('vehicle_details', vehicle_id=vehicle_id))
+
+    trip_sources = [(Trip.query.filter_by(vehicle_id=vehicle_id).options(db.joinedload(Trip.user)),
+                     Trip.start_time, Trip.id)]
+    log_sources = [(VehicleLog.query.filter_by(vehicle_id=vehicle_id), VehicleLog.timestamp, VehicleLog.id)]
+    # El historial archivado se intercala con el reciente en la misma paginación
+    if archive_cutoff():
+        trip_sources.append((ArchivedTrip.query.filter_by(vehicle_id=vehicle_id).options(db.joinedload(ArchivedTrip.user)),
+                             ArchivedTrip.start_time, ArchivedTrip.id))
+        log_sources.append((ArchivedVehicleLog.query.filter_by(vehicle_id=vehicle_id),
+                            ArchivedVehicleLog.timestamp, ArchivedVehicleLog.id))
+    trips, next_trips_cursor = merged_keyset_page(trip_sources, trips_cursor)
+    logs, next_logs_cursor = merged_keyset_page(log_sources, logs_cursor)
+
+    return render_template('vehicle_details.html', vehicle=vehicle, trips=trips, logs=logs,
+                           next_trips_cursor=next_trips_cursor, next_logs_cursor=next_logs_cursor)
 
 @app.route('/set_maintenance/<int:vehicle_id>', methods=['POST'])
 @login_required
@@ -286,8 +634,10 @@ def set_maintenance(vehicle_id):
     try:
         if vehicle.status != 'maintenance':
             vehicle.status = 'maintenance'
-            db.session.commit()
             log_event(vehicle.id, 'En mantenimiento', 'Marcado por el administrador.')
+            publish_event('vehicle_status', vehicle_id=vehicle.id, status=vehicle.status)
+            bump_fleet_version()
+            db.session.commit()
             flash('El vehículo ha sido marcado para mantenimiento.', 'success')
     except Exception as e:
         db.session.rollback()
@@ -310,8 +660,10 @@ def release_maintenance(vehicle_id):
     try:
         if vehicle.status == 'maintenance':
             vehicle.status = 'available'
-            db.session.commit()
             log_event(vehicle.id, 'Disponible', 'Mantenimiento completado.')
+            publish_event('vehicle_status', vehicle_id=vehicle.id, status=vehicle.status)
+            bump_fleet_version()
+            db.session.commit()
             flash('El vehículo ha sido marcado como disponible.', 'success')
     except Exception as e:
         db.session.rollback()
@@ -351,6 +703,9 @@ def report_incident(vehicle_id):
                 vehicle.status = 'incident'
                 log_event(vehicle.id, 'Incidente reportado', f'Reporte de {incident_type} por {current_user.username}.')
 
+            db.session.flush()
+            publish_event('incident_reported', incident_id=new_incident.id, vehicle_id=vehicle.id, status=vehicle.status)
+            bump_fleet_version()
             db.session.commit()
             flash('Reporte de incidente enviado exitosamente.', 'success')
             return redirect(url_for('dashboard'))
@@ -367,8 +722,33 @@ def incident_reports():
         flash('No tienes permiso para ver los reportes de incidentes.', 'danger')
         return redirect(url_for('dashboard'))
 
-    incidents = IncidentReport.query.options(db.joinedload(IncidentReport.user), db.joinedload(IncidentReport.vehicle)).order_by(IncidentReport.report_date.desc()).all()
-    return render_template('incident_reports.html', incidents=incidents)
+    try:
+        cursor = decode_cursor(request.args.get('cursor'))
+    except ValueError:
+        flash('La página solicitada no es válida.', 'warning')
+        return redirect(url_for('incident_reports'))
+
+    incidents, next_cursor = keyset_page(
+        IncidentReport.query.options(db.joinedload(IncidentReport.user), db.joinedload(IncidentReport.vehicle)),
+        IncidentReport.report_date, IncidentReport.id, cursor
+    )
+    return render_template('incident_reports.html', incidents=incidents, next_cursor=next_cursor)
+
+@app.route('/search')
+@login_required
+def search_view():
+    if current_user.role != 'admin':
+        flash('No tienes permiso para realizar búsquedas.', 'danger')
+        return redirect(url_for('dashboard'))
+
+    query = request.args.get('q', '').strip()
+    kind = request.args.get('tipo') or None
+    page = request.args.get('page', 1, type=int)
+    if page < 1:
+        page = 1
+    results, has_next = search(query, kind, page) if query else ([], False)
+    return render_template('search.html', query=query, kind=kind, kinds=KIND_LABELS, page=page,
+                           results=results, has_next=has_next)
 
 @app.route('/view_incident/<int:incident_id>')
 @login_required
@@ -404,6 +784,8 @@ def resolve_incident(incident_id):
             vehicle.status = 'available'  # Asumimos que al resolver el incidente, el vehículo vuelve a estar disponible
             log_event(vehicle.id, 'Incidente Resuelto', f'Incidente #{incident.id} resuelto. Vehículo ahora disponible.')
 
+        publish_event('incident_resolved', incident_id=incident.id, vehicle_id=vehicle.id, status=vehicle.status)
+        bump_fleet_version()
         db.session.commit()
         flash('Incidente marcado como resuelto.', 'success')
     except Exception as e:
@@ -413,16 +795,126 @@ def resolve_incident(incident_id):
     return redirect(url_for('incident_reports'))
 
 
-def log_event(vehicle_id, event, notes=None):
-    log = VehicleLog(vehicle_id=vehicle_id, event=event, notes=notes)
-    db.session.add(log)
-    db.session.commit()
+@app.route('/events')
+@login_required
+def events():
+    # Flujo server-sent events con los cambios de estado de la flota. La
+    # conexión a la base de datos se libera antes de empezar a esperar.
+    try:
+        last_event_id = int(request.headers.get('Last-Event-ID') or request.args.get('last_event_id') or 0) or None
+    except ValueError:
+        abort(400)
+    db.session.remove()
+    stream = event_stream(fleet_events, last_event_id, app.config['EVENTS_HEARTBEAT_SECONDS'])
+    return Response(stream_with_context(stream), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@app.route('/metrics')
+def metrics():
+    # Sólo administradores, o un recolector Prometheus con METRICS_TOKEN
+    token = app.config.get('METRICS_TOKEN')
+    authorized_token = token and request.headers.get('Authorization') == f'Bearer {token}'
+    if not authorized_token and not (current_user.is_authenticated and current_user.role == 'admin'):
+        abort(403)
+    return Response(instrumentation.render_prometheus(), mimetype='text/plain; version=0.0.4; charset=utf-8')
+
+@app.cli.command('db-upgrade')
+def db_upgrade_command():
+    # Aplica las migraciones de esquema pendientes sin perder datos
+    applied = upgrade_database()
+    for version, description in applied:
+        print(f'Migración {version} aplicada: {description}')
+    if not applied:
+        print('La base de datos ya está actualizada.')
+
+@app.cli.command('check-query-plans')
+def check_query_plans_command():
+    # Falla si alguna consulta de las rutas recorre una tabla completa
+    if db.engine.dialect.name != 'sqlite':
+        print('La revisión de planes sólo está disponible con SQLite.')
+        return
+    failed = False
+    for route, description, plan, full_scans in check_query_plans():
+        status = 'ERROR' if full_scans else 'OK'
+        print(f'[{status}] {route}: {description}')
+        for detail in plan:
+            print(f'    {detail}')
+        failed = failed or bool(full_scans)
+    if failed:
+        raise SystemExit(1)
+
+@app.cli.command('generate-fleet')
+@click.option('--vehicles', default=5000, show_default=True)
+@click.option('--trips', default=1_000_000, show_default=True)
+@click.option('--logs', default=5_000_000, show_default=True)
+@click.option('--workers', default=200, show_default=True)
+@click.option('--years', default=3, show_default=True)
+@click.option('--seed', default=42, show_default=True)
+def generate_fleet_command(vehicles, trips, logs, workers, years, seed):
+    # Llena la base de datos con una flota sintética para pruebas de rendimiento
+    upgrade_database()
+    counts = generate_fleet(vehicles=vehicles, trips=trips, logs=logs, workers=workers, years=years, seed=seed)
+    print(f'Datos generados: {counts}')
+
+@app.cli.command('benchmark')
+@click.option('--iterations', default=20, show_default=True)
+@click.option('--threads', default=8, show_default=True, help='Hilos para la prueba de aprobaciones concurrentes.')
+@click.option('--label', default=None, help='Etiqueta de la corrida (p. ej. la versión).')
+@click.option('--fail-on-regression', is_flag=True, help='Termina con error si alguna ruta empeora.')
+def benchmark_command(iterations, threads, label, fail_on_regression):
+    # Mide latencia, consultas y memoria de las rutas principales
+    result, regressions = run_benchmarks(app, iterations=iterations, label=label, threads=threads)
+    concurrent = result['concurrent_approvals']
+    if concurrent and concurrent['double_bookings']:
+        print(f"ERROR: {concurrent['double_bookings']} vehículos quedaron con dos viajes abiertos.")
+        raise SystemExit(1)
+    if fail_on_regression and regressions:
+        raise SystemExit(1)
+
+@app.cli.command('import-vehicles')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--batch-size', default=500, show_default=True)
+@click.option('--dry-run', is_flag=True, help='Valida el archivo sin guardar nada.')
+def import_vehicles_command(path, batch_size, dry_run):
+    # Alta masiva de vehículos desde un archivo CSV o XLSX
+    try:
+        with open(path, 'rb') as f:
+            result = import_vehicles(iter_import_rows(f, path), batch_size=batch_size, dry_run=dry_run)
+    except ImportFileError as e:
+        raise click.ClickException(str(e))
+    for error in result['errors']:
+        print(f"Línea {error['line']} ({error['license_plate'] or 'sin placa'}): {error['error']}")
+    verb = 'válidos' if dry_run else 'creados'
+    print(f"Filas leídas: {result['rows']}. Vehículos {verb}: {result['valid']}. Filas con error: {len(result['errors'])}.")
+    if result['errors']:
+        raise SystemExit(1)
+
+@app.cli.command('archive')
+@click.option('--days', default=None, type=int, help='Antigüedad mínima en días (por omisión ARCHIVE_AFTER_DAYS).')
+@click.option('--batch-size', default=5000, show_default=True)
+def archive_command(days, batch_size):
+    # Mueve los viajes completados y la bitácora antiguos a las tablas de archivo
+    upgrade_database()
+    days = days if days is not None else app.config['ARCHIVE_AFTER_DAYS']
+    cutoff, trips, logs = archive_history(days, batch_size=batch_size)
+    print(f"Archivado hasta {cutoff:%d/%m/%Y}: {trips} viajes y {logs} eventos de bitácora.")
+
+@app.cli.command('rebuild-rollups')
+def rebuild_rollups_command():
+    # Recalcula desde cero los resúmenes de uso por vehículo/día y trabajador/mes
+    vehicle_days, user_months = rebuild_rollups()
+    print(f'Resúmenes recalculados: {vehicle_days} vehículo-día, {user_months} trabajador-mes.')
+
+@app.cli.command('backfill-trip-requests')
+def backfill_trip_requests_command():
+    # Enlaza los viajes existentes con la solicitud que los originó
+    scanned, matched = backfill_trip_requests()
+    print(f'Viajes revisados: {scanned}. Viajes enlazados con su solicitud: {matched}.')
 
 if __name__ == '__main__':
     with app.app_context():
-        # ¡IMPORTANTE! Si acabas de cambiar models.py, DEBES ejecutar:
-        # rm inventario.db
-        db.create_all()
+        # Crea las tablas y aplica las migraciones pendientes (ver migrations.py)
+        upgrade_database()
 
         if not User.query.filter_by(username='admin').first():
             admin_user = User(username='admin', role='admin')
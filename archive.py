@@ -0,0 +1,80 @@
+import heapq
+from datetime import datetime, timedelta
+
+from sqlalchemy import delete, insert, select
+
+from models import db, Trip, VehicleLog, ArchivedTrip, ArchivedVehicleLog, ArchiveState
+from pagination import PAGE_SIZE, encode_cursor, keyset_query
+
+# Archivo de historial: los viajes completados y la bitácora anteriores a un
+# horizonte se mueven a tablas de archivo con el mismo esquema e ids, para que
+# trip y vehicle_log (y sus índices) sólo contengan lo reciente. Las consultas
+# cuyo rango llega antes de ArchiveState.archived_before leen también el archivo.
+
+ARCHIVE_STATE_ID = 1
+ARCHIVE_BATCH_SIZE = 5000
+
+
+def archive_cutoff():
+    state = db.session.get(ArchiveState, ARCHIVE_STATE_ID)
+    return state.archived_before if state else None
+
+
+def reaches_archive(since):
+    # since: inicio del rango consultado (None = sin límite)
+    cutoff = archive_cutoff()
+    return cutoff is not None and (since is None or since < cutoff)
+
+
+def _set_cutoff(cutoff):
+    state = db.session.get(ArchiveState, ARCHIVE_STATE_ID)
+    if not state:
+        db.session.add(ArchiveState(id=ARCHIVE_STATE_ID, archived_before=cutoff, updated_at=datetime.now()))
+    elif state.archived_before is None or state.archived_before < cutoff:
+        state.archived_before = cutoff
+        state.updated_at = datetime.now()
+    db.session.commit()
+
+
+def _move(source, target, condition, batch_size):
+    # Copia y borra por lotes; cada lote es una transacción, así que una fila
+    # siempre está en exactamente una de las dos tablas
+    columns = [column.key for column in target.__table__.columns]
+    moved = 0
+    while True:
+        ids = db.session.scalars(select(source.id).where(condition).limit(batch_size)).all()
+        if not ids:
+            return moved
+        db.session.execute(insert(target).from_select(
+            columns, select(*[source.__table__.c[name] for name in columns]).where(source.id.in_(ids))
+        ))
+        db.session.execute(delete(source).where(source.id.in_(ids)))
+        db.session.commit()
+        moved += len(ids)
+
+
+def archive_history(days, batch_size=ARCHIVE_BATCH_SIZE):
+    # Mueve los viajes completados que salieron, y los eventos registrados,
+    # hace más de `days` días. El corte se publica antes de mover filas para
+    # que los lectores consulten el archivo desde el primer lote.
+    cutoff = datetime.combine(datetime.now().date() - timedelta(days=days), datetime.min.time())
+    _set_cutoff(cutoff)
+    trips = _move(Trip, ArchivedTrip, (Trip.end_time.isnot(None)) & (Trip.start_time < cutoff), batch_size)
+    logs = _move(VehicleLog, ArchivedVehicleLog, VehicleLog.timestamp < cutoff, batch_size)
+    return cutoff, trips, logs
+
+
+def merged_keyset_page(sources, cursor=None, page_size=PAGE_SIZE):
+    # Como keyset_page, pero sobre varias tablas con el mismo orden
+    # (marca de tiempo, id) descendente. sources: [(query, time_column, id_column)]
+    pages = []
+    for query, time_column, id_column in sources:
+        key = lambda row, t=time_column.key, i=id_column.key: (getattr(row, t), getattr(row, i))
+        pages.append([(key(row), row) for row in keyset_query(query, time_column, id_column, cursor, page_size)])
+    rows = [row for _, row in heapq.merge(*pages, key=lambda item: item[0], reverse=True)][:page_size + 1]
+    next_cursor = None
+    if len(rows) > page_size:
+        rows = rows[:page_size]
+        _, time_column, id_column = sources[0]
+        next_cursor = encode_cursor(getattr(rows[-1], time_column.key), getattr(rows[-1], id_column.key))
+    return rows, next_cursor
@@ -0,0 +1,153 @@
+import atexit
+import logging
+import queue
+import threading
+from datetime import datetime
+
+from flask import current_app
+from sqlalchemy import event, insert
+
+from models import db, VehicleLog
+
+logger = logging.getLogger(__name__)
+
+
+def log_event(vehicle_id, event, notes=None):
+    # El registro se agrega a la transacción del llamador y se guarda con su
+    # commit, junto con el cambio de estado del vehículo. Los eventos listados
+    # en AUDIT_BUFFERED_EVENTS esperan al commit y entonces pasan al escritor
+    # en segundo plano; si la transacción se revierte, se descartan.
+    if event in current_app.config.get('AUDIT_BUFFERED_EVENTS', ()) and not audit_writer.is_full():
+        # Se asegura una transacción abierta para que su rollback descarte la fila
+        db.session.connection()
+        row = {'vehicle_id': vehicle_id, 'event': event, 'notes': notes, 'timestamp': datetime.now()}
+        db.session.info.setdefault('buffered_logs', []).append(row)
+        return
+    db.session.add(VehicleLog(vehicle_id=vehicle_id, event=event, notes=notes))
+
+
+def log_events(rows):
+    # Versión por lotes de log_event: rows es una lista de (vehicle_id, evento,
+    # notas); los eventos no diferidos se insertan en una sola sentencia
+    now = datetime.now()
+    buffered = current_app.config.get('AUDIT_BUFFERED_EVENTS', ())
+    staged, inline = [], []
+    for vehicle_id, event, notes in rows:
+        row = {'vehicle_id': vehicle_id, 'event': event, 'notes': notes, 'timestamp': now}
+        (staged if event in buffered else inline).append(row)
+    if staged and audit_writer.is_full():
+        inline += staged
+        staged = []
+    if staged:
+        db.session.connection()
+        db.session.info.setdefault('buffered_logs', []).extend(staged)
+    if inline:
+        db.session.execute(insert(VehicleLog), inline)
+
+
+class AuditWriter:
+    # Escritor en segundo plano para eventos de alto volumen o no críticos:
+    # acumula filas en una cola acotada y las inserta por lotes en una sola
+    # sentencia. Al terminar el proceso se vacía la cola.
+    _STOP = object()
+
+    def __init__(self):
+        self.app = None
+        self._queue = None
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        app.config.setdefault('AUDIT_BUFFERED_EVENTS', ())
+        app.config.setdefault('AUDIT_QUEUE_SIZE', 10000)
+        app.config.setdefault('AUDIT_BATCH_SIZE', 500)
+        app.config.setdefault('AUDIT_FLUSH_INTERVAL', 1.0)
+        self.app = app
+        self._queue = queue.Queue(maxsize=app.config['AUDIT_QUEUE_SIZE'])
+        event.listen(db.session, 'after_commit', self._after_commit)
+        event.listen(db.session, 'after_soft_rollback', self._after_soft_rollback)
+        atexit.register(self.shutdown)
+
+    def is_full(self):
+        # Con la cola llena, log_event escribe en la transacción del llamador
+        return self._queue is None or self._queue.full()
+
+    def enqueue_committed(self, rows):
+        # Filas de una transacción ya confirmada. Las que no caben en la cola
+        # se insertan en el momento con una conexión propia en lugar de perderse.
+        self._ensure_started()
+        overflow = []
+        for row in rows:
+            try:
+                self._queue.put_nowait(row)
+            except queue.Full:
+                overflow.append(row)
+        if overflow:
+            with db.engine.begin() as conn:
+                conn.execute(insert(VehicleLog), overflow)
+
+    def _after_commit(self, session):
+        rows = session.info.pop('buffered_logs', None)
+        if rows:
+            self.enqueue_committed(rows)
+
+    def _after_soft_rollback(self, session, previous_transaction):
+        if previous_transaction.parent is None:
+            session.info.pop('buffered_logs', None)
+
+    def _ensure_started(self):
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='audit-writer', daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        batch_size = self.app.config['AUDIT_BATCH_SIZE']
+        interval = self.app.config['AUDIT_FLUSH_INTERVAL']
+        stopping = False
+        while not stopping:
+            batch = []
+            try:
+                item = self._queue.get(timeout=interval)
+            except queue.Empty:
+                continue
+            while True:
+                if item is self._STOP:
+                    stopping = True
+                    break
+                batch.append(item)
+                if len(batch) >= batch_size:
+                    break
+                try:
+                    item = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+            self._write(batch)
+
+    def _write(self, batch):
+        if not batch:
+            return
+        with self.app.app_context():
+            try:
+                db.session.execute(insert(VehicleLog), batch)
+                db.session.commit()
+            except Exception:
+                db.session.rollback()
+                logger.exception('No se pudieron guardar %d eventos de la bitácora', len(batch))
+            finally:
+                db.session.remove()
+
+    def shutdown(self, timeout=10):
+        if self._thread is None:
+            return
+        try:
+            self._queue.put(self._STOP, timeout=timeout)
+        except queue.Full:
+            logger.error('La cola de la bitácora sigue llena al terminar el proceso')
+        self._thread.join(timeout)
+        self._thread = None
+
+
+audit_writer = AuditWriter()
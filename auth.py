@@ -0,0 +1,158 @@
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FuturesTimeoutError
+
+from flask_login import UserMixin
+from sqlalchemy import event, inspect
+from werkzeug.security import check_password_hash, generate_password_hash
+
+from cache import LRUCache
+from models import db, User
+
+# Identidad de la sesión sin consultar la base de datos en cada petición, y
+# verificación de contraseñas en un pool acotado de hilos. hashlib libera el
+# GIL mientras calcula scrypt/pbkdf2, así que varios inicios de sesión
+# simultáneos se verifican en paralelo sin ocupar más hilos de los previstos.
+#
+# Con `gunicorn -k gevent` el módulo threading está parcheado y los "hilos" de
+# un ThreadPoolExecutor son greenlets del mismo hilo del sistema: un scrypt
+# detendría todo el worker, incluidos los flujos /events abiertos. En ese caso
+# se usa el pool de hilos reales de gevent.
+
+
+class SessionUser(UserMixin):
+    # Datos del usuario que usan las rutas y plantillas (current_user); no es
+    # un objeto del ORM, así que no queda ligado a ninguna sesión de SQLAlchemy
+    def __init__(self, id, username, role):
+        self.id = id
+        self.username = username
+        self.role = role
+
+    @classmethod
+    def from_user(cls, user):
+        return cls(user.id, user.username, user.role)
+
+
+class UserCache:
+    # Cada worker guarda sus propias entradas; los cambios de rol, nombre o
+    # contraseña hechos con el ORM las invalidan en el proceso que los hace y
+    # USER_CACHE_TTL acota cuánto tardan en verse en los demás.
+    _WATCHED = ('username', 'role', 'password_hash')
+
+    def __init__(self):
+        self._cache = LRUCache()
+
+    def init_app(self, app):
+        app.config.setdefault('USER_CACHE_SIZE', 1024)
+        app.config.setdefault('USER_CACHE_TTL', 60)
+        self._cache = LRUCache(app.config['USER_CACHE_SIZE'], ttl=app.config['USER_CACHE_TTL'])
+        event.listen(User, 'after_update', self._after_update)
+        event.listen(User, 'after_delete', self._after_delete)
+        event.listen(db.session, 'after_commit', self._after_commit)
+
+    def load(self, user_id):
+        identity = self._cache.get(user_id)
+        if identity is None:
+            user = db.session.get(User, user_id)
+            if user is None:
+                return None
+            identity = self.remember(user)
+        return identity
+
+    def remember(self, user):
+        identity = SessionUser.from_user(user)
+        self._cache.set(user.id, identity)
+        return identity
+
+    def invalidate(self, user_id):
+        self._cache.delete(user_id)
+
+    def _after_update(self, mapper, connection, user):
+        state = inspect(user)
+        if any(state.attrs[name].history.has_changes() for name in self._WATCHED):
+            self._invalidate_on_commit(user.id)
+
+    def _after_delete(self, mapper, connection, user):
+        self._invalidate_on_commit(user.id)
+
+    def _invalidate_on_commit(self, user_id):
+        # Se invalida de inmediato y otra vez al confirmar, por si otra
+        # petición volvió a cargar la fila vieja antes del commit
+        self.invalidate(user_id)
+        db.session.info.setdefault('invalidated_users', set()).add(user_id)
+
+    def _after_commit(self, session):
+        for user_id in session.info.pop('invalidated_users', ()):
+            self.invalidate(user_id)
+
+
+class LoginBusy(Exception):
+    pass
+
+
+class PasswordHasher:
+    def __init__(self):
+        self._executor = None
+        self._lock = threading.Lock()
+        self._slots = None
+        self.method = 'scrypt'
+        self._prefix = None
+
+    def init_app(self, app):
+        app.config.setdefault('PASSWORD_HASH_METHOD', 'scrypt')
+        app.config.setdefault('PASSWORD_HASH_WORKERS', 4)
+        app.config.setdefault('PASSWORD_HASH_QUEUE', 32)
+        app.config.setdefault('PASSWORD_HASH_TIMEOUT', 10)
+        self.method = app.config['PASSWORD_HASH_METHOD']
+        self.timeout = app.config['PASSWORD_HASH_TIMEOUT']
+        workers = self.workers = app.config['PASSWORD_HASH_WORKERS']
+        # Verificaciones en curso más en espera; por encima se rechaza el intento
+        self._slots = threading.BoundedSemaphore(workers + app.config['PASSWORD_HASH_QUEUE'])
+        # Prefijo "método:parámetros" que genera la configuración actual
+        self._prefix = generate_password_hash('', method=self.method).split('$', 1)[0]
+
+    def _executor_for_submit(self):
+        # El pool se crea con el primer uso: gunicorn aplica el parche de gevent
+        # al iniciar cada worker, que puede ser después de importar la aplicación
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    monkey = sys.modules.get('gevent.monkey')
+                    if monkey is not None and monkey.is_module_patched('threading'):
+                        from gevent.threadpool import ThreadPoolExecutor as GeventThreadPoolExecutor
+                        self._executor = GeventThreadPoolExecutor(max_workers=self.workers)
+                    else:
+                        self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='password-hash')
+        return self._executor
+
+    def _run(self, function, *args):
+        if not self._slots.acquire(blocking=False):
+            raise LoginBusy()
+        try:
+            future = self._executor_for_submit().submit(function, *args)
+        except BaseException:
+            self._slots.release()
+            raise
+        # El lugar se libera cuando el hash termina, no cuando el llamador deja
+        # de esperar; así el límite se mantiene aunque haya tiempos agotados
+        future.add_done_callback(lambda future: self._slots.release())
+        try:
+            return future.result(timeout=self.timeout)
+        except FuturesTimeoutError:
+            future.cancel()
+            raise LoginBusy()
+
+    def verify(self, password_hash, password):
+        if not password_hash:
+            return False
+        return self._run(check_password_hash, password_hash, password)
+
+    def hash(self, password):
+        return self._run(generate_password_hash, password, self.method)
+
+    def needs_rehash(self, password_hash):
+        return password_hash.split('$', 1)[0] != self._prefix
+
+
+user_cache = UserCache()
+password_hasher = PasswordHasher()
@@ -0,0 +1,56 @@
+from fleet_state import bump_fleet_version
+from models import db, Trip, ArchivedTrip, Request
+
+BACKFILL_BATCH_SIZE = 1000
+
+
+def _match_requests(trips, claimed):
+    # Para cada viaje se elige la solicitud aprobada más reciente con el mismo
+    # trabajador, vehículo y destino, hecha antes de la salida y aún sin viaje.
+    candidates = Request.query.filter(
+        Request.status == 'approved',
+        Request.user_id.in_({trip.user_id for trip in trips}),
+        Request.vehicle_id.in_({trip.vehicle_id for trip in trips}),
+        Request.destination.in_({trip.destination for trip in trips}),
+        ~Request.id.in_(db.session.query(Trip.request_id).filter(Trip.request_id.isnot(None))),
+        ~Request.id.in_(db.session.query(ArchivedTrip.request_id).filter(ArchivedTrip.request_id.isnot(None))),
+    ).order_by(Request.date_requested.desc(), Request.id.desc()).all()
+
+    by_key = {}
+    for req in candidates:
+        by_key.setdefault((req.user_id, req.vehicle_id, req.destination), []).append(req)
+
+    matched = 0
+    for trip in trips:
+        for req in by_key.get((trip.user_id, trip.vehicle_id, trip.destination), []):
+            if req.id in claimed or (req.date_requested and req.date_requested > trip.start_time):
+                continue
+            trip.request_id = req.id
+            claimed.add(req.id)
+            matched += 1
+            break
+    return matched
+
+
+def backfill_trip_requests(batch_size=BACKFILL_BATCH_SIZE):
+    # Enlaza los viajes existentes con su solicitud de origen. Devuelve
+    # (viajes revisados, viajes enlazados). Requiere `flask db-upgrade`.
+    scanned = matched = 0
+    claimed = set()
+    last_id = 0
+    while True:
+        # Se avanza por id para no revisar de nuevo los viajes que quedan sin solicitud
+        trips = Trip.query.filter(Trip.request_id.is_(None), Trip.id > last_id) \
+            .order_by(Trip.id).limit(batch_size).all()
+        if not trips:
+            break
+        last_id = trips[-1].id
+        trips.sort(key=lambda trip: (trip.start_time, trip.id))
+        batch_matched = _match_requests(trips, claimed)
+        matched += batch_matched
+        scanned += len(trips)
+        if batch_matched:
+            # Cambian las columnas Responsable/Auditores de los reportes
+            bump_fleet_version()
+        db.session.commit()
+    return scanned, matched
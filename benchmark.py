@@ -0,0 +1,342 @@
+import glob
+import json
+import os
+import statistics
+import subprocess
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+from datetime import date, datetime, timedelta
+
+from sqlalchemy import delete, event, func, update
+
+from audit import audit_writer
+from fleet_state import bump_fleet_version
+from models import db, User, Vehicle, Trip, Request, VehicleLog, IncidentReport, FleetEvent
+from rollups import rebuild_rollups
+
+# Mide las rutas principales con el cliente de pruebas de Flask sobre la base
+# de datos configurada (normalmente una flota generada con `flask generate-fleet`).
+# Por ruta se reportan latencia p50/p95, número de consultas SQL y memoria
+# máxima; los resultados se guardan en JSON y se comparan con la corrida previa.
+# Lo que crean las mediciones (usuarios, solicitudes, viajes, bitácora, eventos)
+# se borra al terminar cada fase y los vehículos vuelven a su estado, para que
+# corridas sucesivas midan la misma base de datos.
+
+RESULTS_DIR = os.path.join(os.path.abspath(os.path.dirname(__file__)), 'benchmark_results')
+# Una ruta se marca como regresión si su p95 crece más de este factor
+REGRESSION_FACTOR = 1.2
+
+
+class _QueryCounter:
+    def __init__(self, engine):
+        self.local = threading.local()
+        event.listen(engine, 'before_cursor_execute', self._count)
+
+    def _count(self, *args, **kwargs):
+        if getattr(self.local, 'active', False):
+            self.local.count += 1
+
+    def start(self):
+        self.local.active = True
+        self.local.count = 0
+
+    def stop(self):
+        self.local.active = False
+        return self.local.count
+
+
+def _client_for(app, user_id):
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session['_user_id'] = str(user_id)
+        session['_fresh'] = True
+    return client
+
+
+def _percentile(values, percent):
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(percent / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def _git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'],
+                                       cwd=os.path.dirname(RESULTS_DIR), stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+# Tablas cuyas filas nuevas se borran al terminar, en orden de dependencias
+_CREATED_ROWS = (FleetEvent, VehicleLog, Trip, Request, User)
+
+
+@contextmanager
+def _restored(app):
+    with app.app_context():
+        marks = {model: db.session.query(func.max(model.id)).scalar() or 0 for model in _CREATED_ROWS}
+        vehicles = {vehicle_id: (status, odometer) for vehicle_id, status, odometer
+                    in db.session.query(Vehicle.id, Vehicle.status, Vehicle.current_odometer)}
+        db.session.remove()
+    try:
+        yield
+    finally:
+        # La bitácora diferida se escribe antes de borrar
+        audit_writer.shutdown()
+        with app.app_context():
+            completed = db.session.query(Trip.id).filter(Trip.id > marks[Trip], Trip.end_time.isnot(None)).first()
+            for model in _CREATED_ROWS:
+                db.session.execute(delete(model).where(model.id > marks[model]))
+            changed = []
+            for vehicle_id, status, odometer, version in db.session.query(
+                    Vehicle.id, Vehicle.status, Vehicle.current_odometer, Vehicle.version):
+                before = vehicles.get(vehicle_id)
+                if before and before != (status, odometer):
+                    changed.append({'id': vehicle_id, 'status': before[0], 'current_odometer': before[1],
+                                    'version': version})
+            if changed:
+                db.session.execute(update(Vehicle), changed)
+            bump_fleet_version()
+            db.session.commit()
+            # Los viajes completados sumaron kilómetros a los resúmenes
+            if completed:
+                rebuild_rollups()
+            db.session.remove()
+
+
+def _ensure_user(username, role):
+    user = User.query.filter_by(username=username).first()
+    if not user:
+        user = User(username=username, role=role)
+        user.set_password(os.urandom(16).hex())
+        db.session.add(user)
+        db.session.commit()
+    return user.id
+
+
+def _pending_request(user_id):
+    # Solicitud pendiente para un vehículo disponible (fuera de la medición)
+    vehicle = Vehicle.query.filter_by(status='available').order_by(func.random()).first()
+    if not vehicle:
+        return None
+    req = Request(user_id=user_id, vehicle_id=vehicle.id, destination='Benchmark',
+                  reason='Medición de rendimiento', responsible_name='Benchmark',
+                  num_auditors=1, auditors_names='Benchmark')
+    db.session.add(req)
+    bump_fleet_version()
+    db.session.commit()
+    return req.id
+
+
+def _scenarios(app, admin_id, worker_id):
+    # Cada escenario: (nombre, usuario, prepare(i) -> (método, url, datos) o None)
+    with app.app_context():
+        busiest_vehicle = db.session.query(Trip.vehicle_id, func.count(Trip.id)) \
+            .group_by(Trip.vehicle_id).order_by(func.count(Trip.id).desc()).first()
+        busiest_vehicle = busiest_vehicle[0] if busiest_vehicle else (db.session.query(func.min(Vehicle.id)).scalar() or 1)
+    first_of_month = date.today().replace(day=1)
+    month_end = first_of_month - timedelta(days=1)
+    month_start = month_end.replace(day=1)
+    month = f'desde={month_start.isoformat()}&hasta={month_end.isoformat()}'
+
+    def cold_dashboard(i):
+        bump_fleet_version()
+        db.session.commit()
+        return 'GET', '/dashboard', None
+
+    # Sólo se completan los viajes que abrió esta corrida
+    approved = []
+
+    def approve(i):
+        request_id = _pending_request(worker_id)
+        if request_id is None:
+            return None
+        approved.append(request_id)
+        return 'GET', f'/approve_request/{request_id}', None
+
+    def complete(i):
+        trip = Trip.query.filter(Trip.end_time.is_(None), Trip.request_id.in_(approved)) \
+            .order_by(Trip.id).first()
+        if not trip:
+            return None
+        return 'POST', f'/complete_trip/{trip.id}', {'end_odometer': str(trip.start_odometer + 25)}
+
+    return [
+        ('dashboard_admin', admin_id, lambda i: ('GET', '/dashboard', None)),
+        ('dashboard_admin_cold', admin_id, cold_dashboard),
+        ('dashboard_worker', worker_id, lambda i: ('GET', '/dashboard', None)),
+        ('report_month', admin_id, lambda i: ('GET', f'/report?{month}', None)),
+        ('report_csv_month', admin_id, lambda i: ('GET', f'/report.csv?{month}', None)),
+        ('vehicle_details', admin_id, lambda i: ('GET', f'/vehicle_details/{busiest_vehicle}', None)),
+        ('incident_reports', admin_id, lambda i: ('GET', '/incident_reports', None)),
+        ('approve_request', admin_id, approve),
+        ('complete_trip', admin_id, complete),
+    ]
+
+
+def run_route_benchmarks(app, iterations=20, progress=print):
+    with app.app_context():
+        admin_id = _ensure_user('benchmark_admin', 'admin')
+        worker_id = _ensure_user('benchmark_worker', 'worker')
+        counter = _QueryCounter(db.engine)
+    results = {}
+    for name, user_id, prepare in _scenarios(app, admin_id, worker_id):
+        client = _client_for(app, user_id)
+        latencies, queries, peak = [], [], None
+        # La iteración 0 sirve de calentamiento y mide la memoria máxima con tracemalloc
+        for i in range(iterations + 1):
+            with app.app_context():
+                prepared = prepare(i)
+            if prepared is None:
+                break
+            method, url, data = prepared
+            if i == 0:
+                tracemalloc.start()
+            counter.start()
+            started = time.perf_counter()
+            response = client.open(url, method=method, data=data)
+            response.get_data()
+            elapsed = time.perf_counter() - started
+            query_count = counter.stop()
+            if i == 0:
+                peak = tracemalloc.get_traced_memory()[1]
+                tracemalloc.stop()
+                continue
+            if response.status_code >= 400:
+                raise RuntimeError(f'{name}: {url} respondió {response.status_code}')
+            latencies.append(elapsed * 1000)
+            queries.append(query_count)
+        if not latencies:
+            progress(f'{name}: sin datos suficientes, se omite')
+            continue
+        results[name] = {
+            'iterations': len(latencies),
+            'p50_ms': round(statistics.median(latencies), 2),
+            'p95_ms': round(_percentile(latencies, 95), 2),
+            'mean_ms': round(statistics.mean(latencies), 2),
+            'queries': max(queries),
+            'peak_kib': round(peak / 1024, 1) if peak is not None else None,
+        }
+        progress(f"{name}: p50 {results[name]['p50_ms']} ms, p95 {results[name]['p95_ms']} ms, "
+                 f"{results[name]['queries']} consultas, {results[name]['peak_kib']} KiB")
+    return results
+
+
+def run_concurrent_approvals(app, threads=8, vehicles=5, requests_per_vehicle=20, progress=print):
+    # Varios administradores aprueban al mismo tiempo solicitudes que compiten
+    # por los mismos vehículos; ningún vehículo debe quedar con dos viajes abiertos.
+    with app.app_context():
+        admin_id = _ensure_user('benchmark_admin', 'admin')
+        worker_id = _ensure_user('benchmark_worker', 'worker')
+        vehicle_ids = [v.id for v in Vehicle.query.filter_by(status='available').limit(vehicles)]
+        request_ids = []
+        for vehicle_id in vehicle_ids:
+            for _ in range(requests_per_vehicle):
+                req = Request(user_id=worker_id, vehicle_id=vehicle_id, destination='Benchmark',
+                              reason='Aprobación concurrente', responsible_name='Benchmark',
+                              num_auditors=1, auditors_names='Benchmark')
+                db.session.add(req)
+                db.session.flush()
+                request_ids.append(req.id)
+        db.session.commit()
+    if not request_ids:
+        progress('concurrent_approvals: no hay vehículos disponibles, se omite')
+        return None
+
+    errors = []
+
+    def approve_all(my_ids):
+        client = _client_for(app, admin_id)
+        for request_id in my_ids:
+            response = client.get(f'/approve_request/{request_id}')
+            if response.status_code >= 400:
+                errors.append(response.status_code)
+
+    workers = [threading.Thread(target=approve_all, args=(request_ids[k::threads],)) for k in range(threads)]
+    started = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    elapsed = time.perf_counter() - started
+
+    with app.app_context():
+        open_trips = dict(
+            db.session.query(Trip.vehicle_id, func.count(Trip.id))
+            .filter(Trip.vehicle_id.in_(vehicle_ids), Trip.end_time.is_(None))
+            .group_by(Trip.vehicle_id).all()
+        )
+    double_bookings = sum(1 for count in open_trips.values() if count > 1)
+    result = {
+        'threads': threads,
+        'attempts': len(request_ids),
+        'approved_vehicles': len(open_trips),
+        'double_bookings': double_bookings,
+        'errors': len(errors),
+        'attempts_per_second': round(len(request_ids) / elapsed, 1),
+    }
+    progress(f"concurrent_approvals: {result['attempts']} intentos con {threads} hilos, "
+             f"{result['attempts_per_second']} intentos/s, dobles reservas: {double_bookings}")
+    return result
+
+
+def database_counts():
+    return {model.__tablename__: db.session.query(func.count(model.id)).scalar()
+            for model in (User, Vehicle, Trip, Request, VehicleLog, IncidentReport)}
+
+
+def latest_result(directory=RESULTS_DIR):
+    files = sorted(glob.glob(os.path.join(directory, '*.json')))
+    if not files:
+        return None
+    with open(files[-1], encoding='utf-8') as f:
+        return json.load(f)
+
+
+def compare(previous, current):
+    # Devuelve líneas de comparación y la lista de rutas con regresión
+    lines, regressions = [], []
+    for name, now in current['routes'].items():
+        before = previous.get('routes', {}).get(name)
+        if not before:
+            continue
+        regressed = now['p95_ms'] > before['p95_ms'] * REGRESSION_FACTOR or now['queries'] > before['queries']
+        if regressed:
+            regressions.append(name)
+        lines.append(f"{'REGRESIÓN ' if regressed else ''}{name}: p95 {before['p95_ms']} -> {now['p95_ms']} ms, "
+                     f"consultas {before['queries']} -> {now['queries']}")
+    return lines, regressions
+
+
+def run_benchmarks(app, iterations=20, label=None, threads=8, directory=RESULTS_DIR, progress=print):
+    with app.app_context():
+        counts = database_counts()
+    progress(f'Datos: {counts}')
+    previous = latest_result(directory)
+    result = {
+        'label': label,
+        'timestamp': datetime.now().isoformat(timespec='seconds'),
+        'git_commit': _git_commit(),
+        'database': app.config['SQLALCHEMY_DATABASE_URI'].split('://', 1)[0],
+        'counts': counts,
+    }
+    with _restored(app):
+        result['routes'] = run_route_benchmarks(app, iterations, progress)
+    with _restored(app):
+        result['concurrent_approvals'] = run_concurrent_approvals(app, threads, progress=progress)
+    os.makedirs(directory, exist_ok=True)
+    filename = datetime.now().strftime('%Y%m%d_%H%M%S') + (f'_{label}' if label else '') + '.json'
+    path = os.path.join(directory, filename)
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(result, f, indent=2, ensure_ascii=False)
+    progress(f'Resultados guardados en {path}')
+
+    regressions = []
+    if previous:
+        lines, regressions = compare(previous, result)
+        progress(f"Comparación con {previous.get('label') or previous['timestamp']}:")
+        for line in lines:
+            progress('  ' + line)
+    return result, regressions
@@ -7,3 +7,101 @@ class Config:
         'sqlite:///' + os.path.join(basedir, 'inventario.db')
     SQLALCHEMY_TRACK_MODIFICATIONS = False
     SECRET_KEY = os.environ.get('SECRET_KEY') or 'una-clave-super-secreta'
+
+    # Caché de las instantáneas del panel: 'memory' (LRU por proceso) o 'file'
+    # (directorio local compartido por todos los workers del servidor)
+    DASHBOARD_CACHE_BACKEND = os.environ.get('DASHBOARD_CACHE_BACKEND') or 'memory'
+    DASHBOARD_CACHE_DIR = os.environ.get('DASHBOARD_CACHE_DIR')
+    DASHBOARD_CACHE_SIZE = int(os.environ.get('DASHBOARD_CACHE_SIZE') or 256)
+
+    # Eventos de la bitácora (VehicleLog.event) que se escriben por lotes en
+    # segundo plano en lugar de en la transacción de la ruta, separados por comas
+    AUDIT_BUFFERED_EVENTS = tuple(
+        event.strip() for event in (os.environ.get('AUDIT_BUFFERED_EVENTS') or '').split(',') if event.strip()
+    )
+    AUDIT_QUEUE_SIZE = int(os.environ.get('AUDIT_QUEUE_SIZE') or 10000)
+
+    # Reintentos ante bloqueos transitorios al reservar vehículos
+    RESERVATION_RETRIES = int(os.environ.get('RESERVATION_RETRIES') or 3)
+    RESERVATION_RETRY_DELAY = float(os.environ.get('RESERVATION_RETRY_DELAY') or 0.05)
+    # Reservas con horario: duración máxima y margen para considerar que una
+    # reserva empieza "ahora" (se aprueba creando el viaje de inmediato)
+    RESERVATION_MAX_DAYS = int(os.environ.get('RESERVATION_MAX_DAYS') or 14)
+    RESERVATION_START_GRACE_MINUTES = int(os.environ.get('RESERVATION_START_GRACE_MINUTES') or 30)
+
+    # Instrumentación (/metrics): umbrales de consultas y peticiones lentas
+    SLOW_QUERY_MS = float(os.environ.get('SLOW_QUERY_MS') or 100)
+    SLOW_REQUEST_MS = float(os.environ.get('SLOW_REQUEST_MS') or 1000)
+    SLOW_REQUEST_LOG = (os.environ.get('SLOW_REQUEST_LOG') or '').lower() in ('1', 'true', 'yes')
+    METRICS_TOKEN = os.environ.get('METRICS_TOKEN')
+
+    # Identidad de la sesión en caché por worker (segundos de vigencia)
+    USER_CACHE_SIZE = int(os.environ.get('USER_CACHE_SIZE') or 1024)
+    USER_CACHE_TTL = int(os.environ.get('USER_CACHE_TTL') or 60)
+    # Hash de contraseñas: método de werkzeug con sus parámetros, p. ej.
+    # 'scrypt:32768:8:1' o 'pbkdf2:sha256:600000'. Las contraseñas con otro
+    # método se vuelven a calcular al iniciar sesión.
+    PASSWORD_HASH_METHOD = os.environ.get('PASSWORD_HASH_METHOD') or 'scrypt'
+    PASSWORD_HASH_WORKERS = int(os.environ.get('PASSWORD_HASH_WORKERS') or 4)
+    PASSWORD_HASH_QUEUE = int(os.environ.get('PASSWORD_HASH_QUEUE') or 32)
+
+    # Reportes en segundo plano: procesos que generan a la vez, trabajos
+    # admitidos por worker web y número de archivos que se conservan en disco
+    REPORT_JOBS_DIR = os.environ.get('REPORT_JOBS_DIR')
+    REPORT_JOBS_WORKERS = int(os.environ.get('REPORT_JOBS_WORKERS') or 2)
+    REPORT_JOBS_QUEUE = int(os.environ.get('REPORT_JOBS_QUEUE') or 8)
+    REPORT_JOBS_TIMEOUT = int(os.environ.get('REPORT_JOBS_TIMEOUT') or 1800)
+    REPORT_CACHE_SIZE = int(os.environ.get('REPORT_CACHE_SIZE') or 64)
+
+    # Días tras los cuales `flask archive` mueve viajes y bitácora a las tablas de archivo
+    ARCHIVE_AFTER_DAYS = int(os.environ.get('ARCHIVE_AFTER_DAYS') or 365)
+
+    # Flujo de eventos /events: 'local' reparte sólo dentro del proceso;
+    # 'database' pasa por la tabla fleet_event para llegar a todos los workers
+    EVENTS_BROKER = os.environ.get('EVENTS_BROKER') or 'local'
+    EVENTS_POLL_INTERVAL = float(os.environ.get('EVENTS_POLL_INTERVAL') or 1.0)
+    EVENTS_RETENTION_HOURS = int(os.environ.get('EVENTS_RETENTION_HOURS') or 24)
+    # Tiempo máximo entre que un evento recibe su id y se confirma (broker 'database')
+    EVENTS_LATE_WINDOW_SECONDS = int(os.environ.get('EVENTS_LATE_WINDOW_SECONDS') or 60)
+    EVENTS_HEARTBEAT_SECONDS = int(os.environ.get('EVENTS_HEARTBEAT_SECONDS') or 15)
+
+
+class SQLiteConfig(Config):
+    # SQLite en modo WAL: los lectores no se bloquean mientras alguien escribe
+    # y varios workers de gunicorn pueden compartir el archivo.
+    SQLITE_PRAGMAS = {
+        'journal_mode': 'WAL',
+        'synchronous': 'NORMAL',
+        'busy_timeout': int(os.environ.get('SQLITE_BUSY_TIMEOUT_MS') or 5000),
+        'mmap_size': int(os.environ.get('SQLITE_MMAP_SIZE') or 256 * 1024 * 1024),
+        # Negativo = tamaño en KiB (64 MiB por conexión)
+        'cache_size': int(os.environ.get('SQLITE_CACHE_SIZE') or -64000),
+    }
+
+
+class ServerDBConfig(Config):
+    # PostgreSQL/MySQL u otro servidor indicado en DATABASE_URL, con pool de conexiones
+    SQLALCHEMY_ENGINE_OPTIONS = {
+        'pool_size': int(os.environ.get('DB_POOL_SIZE') or 10),
+        'max_overflow': int(os.environ.get('DB_MAX_OVERFLOW') or 20),
+        'pool_timeout': int(os.environ.get('DB_POOL_TIMEOUT') or 30),
+        'pool_pre_ping': (os.environ.get('DB_POOL_PRE_PING') or 'true').lower() in ('1', 'true', 'yes'),
+        'pool_recycle': int(os.environ.get('DB_POOL_RECYCLE') or 1800),
+    }
+
+
+config_profiles = {
+    'sqlite': SQLiteConfig,
+    'server': ServerDBConfig,
+}
+
+
+def get_config(name=None):
+    # El perfil se elige con APP_CONFIG; si no se indica, se deduce de DATABASE_URL
+    name = name or os.environ.get('APP_CONFIG')
+    if not name:
+        name = 'sqlite' if Config.SQLALCHEMY_DATABASE_URI.startswith('sqlite') else 'server'
+    try:
+        return config_profiles[name]
+    except KeyError:
+        raise ValueError(f"Perfil de configuración desconocido: {name!r} (opciones: {', '.join(config_profiles)})")
@@ -0,0 +1,255 @@
+import itertools
+import json
+import logging
+import threading
+import time
+from collections import deque
+from datetime import datetime, timedelta
+
+from flask import current_app
+from sqlalchemy import delete, event
+
+from models import db, FleetEvent
+
+logger = logging.getLogger(__name__)
+
+# Eventos de cambio de estado de la flota para el flujo /events (server-sent
+# events). Las rutas llaman a publish_event() dentro de su transacción y el
+# evento sólo se entrega si el commit tiene éxito.
+#
+# Los suscriptores esperan con threading.Condition, que gevent/eventlet
+# convierten en espera cooperativa: con `gunicorn -k gevent` cientos de
+# conexiones inactivas no ocupan un hilo cada una.
+
+RECENT_EVENTS = 1000
+
+
+class Subscription:
+    def __init__(self, broker):
+        self.broker = broker
+        self.queue = deque(maxlen=RECENT_EVENTS)
+        self.condition = threading.Condition()
+
+    def push(self, item):
+        with self.condition:
+            self.queue.append(item)
+            self.condition.notify()
+
+    def get(self, timeout):
+        # Devuelve el siguiente (id, tipo, datos) o None si se agotó el tiempo
+        with self.condition:
+            if not self.queue:
+                self.condition.wait(timeout)
+            return self.queue.popleft() if self.queue else None
+
+    def close(self):
+        self.broker.unsubscribe(self)
+
+
+class LocalBroker:
+    # Reparte los eventos entre los suscriptores del mismo proceso. Es el
+    # broker por omisión y el que se usa en pruebas.
+    def __init__(self):
+        self._subscribers = set()
+        self._recent = deque(maxlen=RECENT_EVENTS)
+        self._lock = threading.Lock()
+        self._ids = itertools.count(1)
+
+    def subscribe(self, last_event_id=None):
+        subscription = Subscription(self)
+        with self._lock:
+            self._subscribers.add(subscription)
+            # Reenvía lo que el cliente perdió al reconectarse (Last-Event-ID)
+            if last_event_id is not None:
+                for item in self._recent:
+                    if item[0] > last_event_id:
+                        subscription.push(item)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            self._subscribers.discard(subscription)
+
+    def publish_committed(self, events):
+        for event_type, data in events:
+            self.deliver(next(self._ids), event_type, data)
+
+    def deliver(self, event_id, event_type, data):
+        item = (event_id, event_type, data)
+        with self._lock:
+            self._recent.append(item)
+            subscribers = list(self._subscribers)
+        for subscription in subscribers:
+            subscription.push(item)
+
+    @property
+    def subscriber_count(self):
+        return len(self._subscribers)
+
+
+class DatabaseBroker(LocalBroker):
+    # Para varios workers: los eventos se guardan en la tabla fleet_event en la
+    # misma transacción que el cambio, y un único hilo por proceso lee las
+    # filas nuevas y las reparte a los suscriptores locales.
+    #
+    # En un servidor de base de datos el id se asigna antes del commit: una
+    # transacción lenta puede confirmar un id menor que otro ya repartido. Por
+    # eso además de las filas con id mayor al último se relee la ventana de
+    # EVENTS_LATE_WINDOW_SECONDS y se descartan los ids ya repartidos.
+    def __init__(self, app):
+        super().__init__()
+        self.app = app
+        self.interval = app.config['EVENTS_POLL_INTERVAL']
+        self.retention = timedelta(hours=app.config['EVENTS_RETENTION_HOURS'])
+        self.late_window = timedelta(seconds=app.config['EVENTS_LATE_WINDOW_SECONDS'])
+        self._last_id = None
+        self._delivered = {}
+        self._poller = None
+
+    def subscribe(self, last_event_id=None):
+        self._ensure_poller()
+        subscription = Subscription(self)
+        with self._lock:
+            self._subscribers.add(subscription)
+            # Se reenvía en el orden en que se repartieron los eventos; si el
+            # id ya no está en memoria, el historial sale de la tabla hasta la
+            # última fila repartida
+            recent_ids = [item[0] for item in self._recent]
+            if last_event_id is not None and last_event_id in recent_ids:
+                for item in list(self._recent)[recent_ids.index(last_event_id) + 1:]:
+                    subscription.push(item)
+            elif last_event_id is not None:
+                with self.app.app_context():
+                    rows = FleetEvent.query.filter(FleetEvent.id > last_event_id, FleetEvent.id <= self._last_id) \
+                        .order_by(FleetEvent.id.desc()).limit(RECENT_EVENTS).all()
+                    for row in reversed(rows):
+                        subscription.push((row.id, row.event_type, json.loads(row.payload)))
+                    db.session.remove()
+        return subscription
+
+    def deliver(self, event_id, event_type, data):
+        item = (event_id, event_type, data)
+        with self._lock:
+            self._recent.append(item)
+            self._delivered[event_id] = datetime.now()
+            self._last_id = max(self._last_id, event_id)
+            subscribers = list(self._subscribers)
+        for subscription in subscribers:
+            subscription.push(item)
+
+    def publish_committed(self, events):
+        # Ya se insertaron en la transacción; el hilo lector los entregará
+        pass
+
+    def _ensure_poller(self):
+        if self._poller is not None:
+            return
+        with self._lock:
+            if self._poller is None:
+                with self.app.app_context():
+                    self._last_id = db.session.query(db.func.max(FleetEvent.id)).scalar() or 0
+                    # Lo ya confirmado dentro de la ventana no se reparte como tardío
+                    recent = db.session.query(FleetEvent.id) \
+                        .filter(FleetEvent.created_at >= datetime.now() - self.late_window)
+                    self._delivered = {event_id: datetime.now() for (event_id,) in recent}
+                    db.session.remove()
+                self._poller = threading.Thread(target=self._poll, name='fleet-events', daemon=True)
+                self._poller.start()
+
+    def _poll(self):
+        # Se lee aunque no haya suscriptores: así _last_id avanza y el próximo
+        # cliente sin Last-Event-ID no recibe como nuevos los eventos
+        # confirmados mientras nadie escuchaba
+        last_prune = 0
+        while True:
+            time.sleep(self.interval)
+            with self.app.app_context():
+                try:
+                    self.poll_once()
+                    if time.monotonic() - last_prune > 600:
+                        self.prune()
+                        last_prune = time.monotonic()
+                except Exception:
+                    db.session.rollback()
+                    logger.exception('No se pudieron leer los eventos de la flota')
+                finally:
+                    db.session.remove()
+
+    def poll_once(self):
+        self._deliver_late()
+        rows = FleetEvent.query.filter(FleetEvent.id > self._last_id) \
+            .order_by(FleetEvent.id).limit(500).all()
+        for row in rows:
+            if row.id not in self._delivered:
+                self.deliver(row.id, row.event_type, json.loads(row.payload))
+
+    def prune(self):
+        db.session.execute(delete(FleetEvent).where(FleetEvent.created_at < datetime.now() - self.retention))
+        db.session.commit()
+
+    def _deliver_late(self):
+        # Filas con id menor al último repartido que confirmaron después
+        now = datetime.now()
+        rows = FleetEvent.query.filter(
+            FleetEvent.id < self._last_id,
+            FleetEvent.created_at >= now - self.late_window,
+        ).order_by(FleetEvent.id).all()
+        for row in rows:
+            if row.id not in self._delivered:
+                self.deliver(row.id, row.event_type, json.loads(row.payload))
+        # Un id repartido hace más de dos ventanas ya no puede volver a leerse
+        with self._lock:
+            self._delivered = {event_id: delivered_at for event_id, delivered_at in self._delivered.items()
+                               if delivered_at >= now - 2 * self.late_window}
+
+
+def publish_event(event_type, **data):
+    # Registra el evento en la transacción actual
+    if current_app.config['EVENTS_BROKER'] == 'database':
+        db.session.add(FleetEvent(event_type=event_type, payload=json.dumps(data, default=str)))
+    db.session.info.setdefault('pending_events', []).append((event_type, data))
+
+
+def init_events(app):
+    app.config.setdefault('EVENTS_BROKER', 'local')
+    app.config.setdefault('EVENTS_POLL_INTERVAL', 1.0)
+    app.config.setdefault('EVENTS_RETENTION_HOURS', 24)
+    app.config.setdefault('EVENTS_LATE_WINDOW_SECONDS', 60)
+    app.config.setdefault('EVENTS_HEARTBEAT_SECONDS', 15)
+    if app.config['EVENTS_BROKER'] == 'database':
+        broker = DatabaseBroker(app)
+    else:
+        broker = LocalBroker()
+    app.extensions['fleet_events'] = broker
+
+    @event.listens_for(db.session, 'after_commit')
+    def deliver_pending_events(session):
+        pending = session.info.pop('pending_events', None)
+        if pending:
+            broker.publish_committed(pending)
+
+    @event.listens_for(db.session, 'after_soft_rollback')
+    def discard_pending_events(session, previous_transaction):
+        if previous_transaction.parent is None:
+            session.info.pop('pending_events', None)
+
+    return broker
+
+
+def format_sse(event_id, event_type, data):
+    return f'id: {event_id}\nevent: {event_type}\ndata: {json.dumps(data, default=str)}\n\n'
+
+
+def event_stream(broker, last_event_id=None, heartbeat=15):
+    subscription = broker.subscribe(last_event_id)
+    try:
+        yield 'retry: 3000\n\n'
+        while True:
+            item = subscription.get(timeout=heartbeat)
+            if item is None:
+                # Comentario SSE para mantener viva la conexión a través de proxies
+                yield ': ping\n\n'
+            else:
+                yield format_sse(*item)
+    finally:
+        subscription.close()
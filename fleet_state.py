@@ -0,0 +1,30 @@
+from datetime import datetime
+
+from sqlalchemy import update
+
+from models import db, FleetState
+
+FLEET_STATE_ID = 1
+
+
+def fleet_state():
+    # (versión, fecha del último cambio); una sola lectura por llave primaria
+    state = db.session.get(FleetState, FLEET_STATE_ID)
+    if not state:
+        return 0, None
+    return state.version, state.updated_at
+
+
+def fleet_version():
+    return fleet_state()[0]
+
+
+def bump_fleet_version():
+    # Se ejecuta dentro de la transacción del llamador; el commit lo hace la ruta
+    result = db.session.execute(
+        update(FleetState)
+        .where(FleetState.id == FLEET_STATE_ID)
+        .values(version=FleetState.version + 1, updated_at=datetime.now())
+    )
+    if not result.rowcount:
+        db.session.add(FleetState(id=FLEET_STATE_ID, version=1, updated_at=datetime.now()))
@@ -0,0 +1,209 @@
+import random
+from datetime import datetime, timedelta
+
+from sqlalchemy import bindparam, func, insert, update
+from werkzeug.security import generate_password_hash
+
+from fleet_state import bump_fleet_version
+from models import db, User, Vehicle, Trip, Request, VehicleLog, IncidentReport
+
+# Generador de una flota sintética para medir la aplicación a escala. Las filas
+# se insertan por lotes con INSERT de varios valores, sin pasar por el ORM.
+
+MAKES = {
+    'Nissan': ['Tsuru', 'Versa', 'NP300', 'March'],
+    'Volkswagen': ['Jetta', 'Vento', 'Saveiro', 'Gol'],
+    'Chevrolet': ['Aveo', 'Spark', 'S10', 'Beat'],
+    'Toyota': ['Hilux', 'Yaris', 'Corolla'],
+    'Ford': ['Ranger', 'Figo', 'Ecosport'],
+}
+DESTINATIONS = [
+    'Apizaco', 'Huamantla', 'Calpulalpan', 'Tlaxco', 'Zacatelco', 'Chiautempan',
+    'Tlaxcala Centro', 'Contla', 'Papalotla', 'Tetla', 'Nanacamilpa', 'Ixtacuixtla',
+    'Hueyotlipan', 'Xaloztoc', 'Tzompantepec', 'San Pablo del Monte', 'Cuapiaxtla',
+]
+REASONS = ['Auditoría de obra pública', 'Revisión documental', 'Entrega de oficios',
+           'Auditoría financiera', 'Visita de inspección', 'Reunión de cierre']
+INCIDENT_TYPES = ['Choque', 'Falla Mecánica', 'Daño', 'Ponchadura']
+AUDITOR_NAMES = ['Ana López', 'Carlos Pérez', 'María Hernández', 'José Sánchez',
+                 'Laura Flores', 'Miguel Torres', 'Sofía Ramírez', 'Jorge Cruz']
+
+BATCH_SIZE = 10000
+
+
+class _BatchInserter:
+    # `before` se vacía primero para que las llaves foráneas ya existan
+    def __init__(self, model, before=None):
+        self.model = model
+        self.before = before
+        self.rows = []
+        self.count = 0
+
+    def add(self, row):
+        self.rows.append(row)
+        if len(self.rows) >= BATCH_SIZE:
+            self.flush()
+
+    def flush(self):
+        if self.before:
+            self.before.flush()
+        if self.rows:
+            db.session.execute(insert(self.model), self.rows)
+            db.session.commit()
+            self.count += len(self.rows)
+            self.rows = []
+
+
+def _next_id(model):
+    return (db.session.query(func.max(model.id)).scalar() or 0) + 1
+
+
+def generate_fleet(vehicles=5000, trips=1_000_000, logs=5_000_000, workers=200,
+                   years=3, incident_rate=0.01, seed=42, progress=print):
+    rng = random.Random(seed)
+    now = datetime.now().replace(microsecond=0)
+    start = now - timedelta(days=365 * years)
+
+    # Trabajadores: todos comparten la contraseña 'demo123' (un solo hash)
+    password_hash = generate_password_hash('demo123')
+    first_user = _next_id(User)
+    users = _BatchInserter(User)
+    for i in range(workers):
+        users.add({'id': first_user + i, 'username': f'trabajador{first_user + i:05d}',
+                   'password_hash': password_hash, 'role': 'worker'})
+    users.flush()
+    user_ids = list(range(first_user, first_user + workers))
+    # Pocos trabajadores hacen la mayoría de los viajes
+    user_weights = [rng.paretovariate(1.5) for _ in user_ids]
+    progress(f'Usuarios: {users.count}')
+
+    # Vehículos: se insertan primero; estado y odómetro final se ajustan al terminar
+    first_vehicle = _next_id(Vehicle)
+    vehicle_ids = list(range(first_vehicle, first_vehicle + vehicles))
+    vehicle_inserter = _BatchInserter(Vehicle)
+    for vehicle_id in vehicle_ids:
+        make = rng.choice(list(MAKES))
+        vehicle_inserter.add({
+            'id': vehicle_id, 'license_plate': f'GEN-{vehicle_id:06d}', 'make': make,
+            'model': rng.choice(MAKES[make]), 'status': 'available', 'current_odometer': 0, 'version': 1,
+        })
+    vehicle_inserter.flush()
+    progress(f'Vehículos: {vehicle_inserter.count}')
+
+    # El uso de los vehículos se reparte con cola larga
+    weights = [rng.paretovariate(2.0) for _ in vehicle_ids]
+    total_weight = sum(weights)
+    trips_per_vehicle = [int(trips * w / total_weight) for w in weights]
+    trips_per_vehicle[0] += trips - sum(trips_per_vehicle)
+
+    request_inserter = _BatchInserter(Request)
+    trip_inserter = _BatchInserter(Trip, before=request_inserter)
+    log_inserter = _BatchInserter(VehicleLog)
+    incident_inserter = _BatchInserter(IncidentReport)
+    next_trip = _next_id(Trip)
+    next_request = _next_id(Request)
+    span = (now - start).total_seconds()
+
+    final_state = []
+    for position, (vehicle_id, n_trips) in enumerate(zip(vehicle_ids, trips_per_vehicle), start=1):
+        odometer = rng.randint(0, 80000)
+        vehicle_log_rows = [{'vehicle_id': vehicle_id, 'timestamp': start, 'event': 'Creado',
+                             'notes': 'Vehículo añadido al sistema.'}]
+        status = 'available'
+        # Salidas repartidas en el periodo, ordenadas para que el odómetro crezca
+        departures = sorted(start + timedelta(seconds=rng.random() * span) for _ in range(n_trips))
+        for index, departure in enumerate(departures):
+            user_id = rng.choices(user_ids, user_weights)[0]
+            destination = rng.choice(DESTINATIONS)
+            reason = rng.choice(REASONS)
+            num_auditors = rng.randint(1, 5)
+            km = max(5, int(rng.lognormvariate(4.2, 0.6)))
+            duration = timedelta(hours=max(1.0, rng.gauss(7, 3)))
+            # El último viaje de algunos vehículos sigue en curso
+            is_open = index == n_trips - 1 and rng.random() < 0.1
+            end_time = None if is_open else min(departure + duration, now)
+
+            request_inserter.add({
+                'id': next_request, 'user_id': user_id, 'vehicle_id': vehicle_id,
+                'destination': destination, 'reason': reason, 'status': 'approved',
+                'date_requested': departure - timedelta(minutes=rng.randint(5, 600)),
+                'responsible_name': rng.choice(AUDITOR_NAMES), 'num_auditors': num_auditors,
+                'auditors_names': ', '.join(rng.sample(AUDITOR_NAMES, num_auditors)),
+            })
+            trip_inserter.add({
+                'id': next_trip, 'request_id': next_request, 'user_id': user_id,
+                'vehicle_id': vehicle_id, 'destination': destination, 'reason': reason,
+                'start_time': departure, 'end_time': end_time, 'start_odometer': odometer,
+                'end_odometer': None if is_open else odometer + km,
+                'km_traveled': None if is_open else km,
+            })
+            vehicle_log_rows.append({'vehicle_id': vehicle_id, 'timestamp': departure, 'event': 'En uso',
+                                     'notes': f'Asignado a trabajador{user_id:05d} para viaje a {destination}'})
+            if is_open:
+                status = 'in_use'
+            else:
+                odometer += km
+                vehicle_log_rows.append({'vehicle_id': vehicle_id, 'timestamp': end_time, 'event': 'Disponible',
+                                         'notes': f'Viaje completado. Kilómetros recorridos: {km}'})
+                if rng.random() < incident_rate:
+                    incident_inserter.add({
+                        'vehicle_id': vehicle_id, 'user_id': user_id, 'report_date': end_time,
+                        'incident_type': rng.choice(INCIDENT_TYPES),
+                        'description': f'Incidente durante el viaje a {destination}.',
+                        'location': f'Carretera a {destination}',
+                        'status': 'resolved' if end_time < now - timedelta(days=7) else 'pending',
+                    })
+            next_trip += 1
+            next_request += 1
+
+        if status == 'available' and rng.random() < 0.03:
+            status = 'maintenance'
+        for row in vehicle_log_rows:
+            log_inserter.add(row)
+        final_state.append({'b_id': vehicle_id, 'status': status, 'current_odometer': odometer})
+        if position % 500 == 0:
+            progress(f'Vehículos procesados: {position}/{vehicles}, viajes: {trip_inserter.count}')
+
+    vehicle_table = Vehicle.__table__
+    db.session.execute(
+        update(vehicle_table).where(vehicle_table.c.id == bindparam('b_id')),
+        final_state
+    )
+    db.session.commit()
+
+    # Solicitudes pendientes y rechazadas recientes
+    for _ in range(max(1, trips // 2000)):
+        request_inserter.add({
+            'id': next_request, 'user_id': rng.choice(user_ids), 'vehicle_id': rng.choice(vehicle_ids),
+            'destination': rng.choice(DESTINATIONS), 'reason': rng.choice(REASONS),
+            'status': rng.choice(['pending', 'rejected']),
+            'date_requested': now - timedelta(hours=rng.randint(1, 72)),
+            'responsible_name': rng.choice(AUDITOR_NAMES), 'num_auditors': 1,
+            'auditors_names': rng.choice(AUDITOR_NAMES),
+        })
+        next_request += 1
+
+    # Eventos de mantenimiento hasta completar el volumen de bitácora pedido
+    missing_logs = logs - (log_inserter.count + len(log_inserter.rows))
+    for _ in range(max(0, missing_logs)):
+        log_inserter.add({
+            'vehicle_id': rng.choice(vehicle_ids),
+            'timestamp': start + timedelta(seconds=rng.random() * span),
+            'event': rng.choice(['En mantenimiento', 'Disponible']),
+            'notes': 'Servicio programado.',
+        })
+
+    for inserter in (request_inserter, trip_inserter, log_inserter, incident_inserter):
+        inserter.flush()
+    # Invalida las instantáneas del panel y los reportes guardados
+    bump_fleet_version()
+    db.session.commit()
+
+    return {
+        'users': users.count,
+        'vehicles': vehicle_inserter.count,
+        'trips': trip_inserter.count,
+        'requests': request_inserter.count,
+        'logs': log_inserter.count,
+        'incidents': incident_inserter.count,
+    }
@@ -0,0 +1,158 @@
+import logging
+import threading
+import time
+from collections import defaultdict, deque
+
+from flask import g, has_request_context, request, before_render_template, template_rendered
+from sqlalchemy import event
+
+from models import db
+
+logger = logging.getLogger(__name__)
+
+# Métricas por ruta: latencia, consultas SQL, tiempo en SQL y en plantillas
+# Jinja, más muestras de consultas lentas. Se acumulan en memoria del proceso
+# (cada worker expone las suyas) y se publican en formato de texto Prometheus.
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500)
+
+
+class _Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.total = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+        self.total += 1
+        self.sum += value
+
+
+def _label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', ' ')
+
+
+class Instrumentation:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.latency = defaultdict(lambda: _Histogram(LATENCY_BUCKETS))
+        self.queries = defaultdict(lambda: _Histogram(QUERY_BUCKETS))
+        self.sql_seconds = defaultdict(float)
+        self.render_seconds = defaultdict(float)
+        self.slow_queries = defaultdict(lambda: deque(maxlen=10))
+        self.slow_query_count = defaultdict(int)
+
+    def init_app(self, app):
+        app.config.setdefault('SLOW_QUERY_MS', 100)
+        app.config.setdefault('SLOW_REQUEST_MS', 1000)
+        app.config.setdefault('SLOW_REQUEST_LOG', False)
+        self.slow_query_seconds = app.config['SLOW_QUERY_MS'] / 1000
+        self.slow_request_seconds = app.config['SLOW_REQUEST_MS'] / 1000
+        self.log_slow_requests = app.config['SLOW_REQUEST_LOG']
+
+        with app.app_context():
+            event.listen(db.engine, 'before_cursor_execute', self._before_cursor_execute)
+            event.listen(db.engine, 'after_cursor_execute', self._after_cursor_execute)
+        before_render_template.connect(self._before_render, app)
+        template_rendered.connect(self._after_render, app)
+        app.before_request(self._before_request)
+        app.after_request(self._after_request)
+
+    # --- Flask ---
+    def _before_request(self):
+        g.metrics = {'start': time.perf_counter(), 'queries': 0, 'sql': 0.0, 'render': 0.0, 'statements': []}
+
+    def _after_request(self, response):
+        metrics = g.pop('metrics', None)
+        if metrics is None:
+            return response
+        endpoint = request.endpoint or 'desconocido'
+        elapsed = time.perf_counter() - metrics['start']
+        with self._lock:
+            self.latency[endpoint].observe(elapsed)
+            self.queries[endpoint].observe(metrics['queries'])
+            self.sql_seconds[endpoint] += metrics['sql']
+            self.render_seconds[endpoint] += metrics['render']
+        if self.log_slow_requests and elapsed >= self.slow_request_seconds:
+            statements = '\n'.join(f'  {duration * 1000:.1f} ms: {statement}'
+                                   for duration, statement in metrics['statements'])
+            logger.warning('Petición lenta %s %s: %.1f ms, %d consultas (%.1f ms en SQL, %.1f ms en plantillas)\n%s',
+                           request.method, request.path, elapsed * 1000, metrics['queries'],
+                           metrics['sql'] * 1000, metrics['render'] * 1000, statements)
+        return response
+
+    def _before_render(self, sender, template, context, **extra):
+        if 'metrics' in g:
+            g.metrics['render_start'] = time.perf_counter()
+
+    def _after_render(self, sender, template, context, **extra):
+        if 'metrics' in g and 'render_start' in g.metrics:
+            g.metrics['render'] += time.perf_counter() - g.metrics.pop('render_start')
+
+    # --- SQLAlchemy ---
+    def _before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('query_start', []).append(time.perf_counter())
+
+    def _after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        duration = time.perf_counter() - conn.info['query_start'].pop()
+        if not has_request_context() or 'metrics' not in g:
+            return
+        metrics = g.metrics
+        metrics['queries'] += 1
+        metrics['sql'] += duration
+        if self.log_slow_requests and len(metrics['statements']) < 50:
+            metrics['statements'].append((duration, statement))
+        if duration >= self.slow_query_seconds:
+            endpoint = request.endpoint or 'desconocido'
+            with self._lock:
+                self.slow_query_count[endpoint] += 1
+                self.slow_queries[endpoint].append((duration, ' '.join(statement.split())[:300]))
+
+    # --- Exposición ---
+    def render_prometheus(self):
+        lines = []
+        with self._lock:
+            self._histogram_lines(lines, 'ofs_request_duration_seconds',
+                                  'Latencia de las peticiones por ruta.', self.latency)
+            self._histogram_lines(lines, 'ofs_request_queries',
+                                  'Consultas SQL por petición.', self.queries)
+            self._counter_lines(lines, 'ofs_request_sql_seconds_total',
+                                'Tiempo total en consultas SQL por ruta.', self.sql_seconds)
+            self._counter_lines(lines, 'ofs_template_render_seconds_total',
+                                'Tiempo total de renderizado de plantillas Jinja por ruta.', self.render_seconds)
+            self._counter_lines(lines, 'ofs_slow_queries_total',
+                                'Consultas que superaron SLOW_QUERY_MS.', self.slow_query_count)
+            lines.append('# HELP ofs_slow_query_sample_seconds Muestras recientes de consultas lentas.')
+            lines.append('# TYPE ofs_slow_query_sample_seconds gauge')
+            for endpoint, samples in sorted(self.slow_queries.items()):
+                for duration, statement in samples:
+                    lines.append(f'ofs_slow_query_sample_seconds{{endpoint="{_label(endpoint)}",'
+                                 f'statement="{_label(statement)}"}} {duration:.6f}')
+        return '\n'.join(lines) + '\n'
+
+    @staticmethod
+    def _histogram_lines(lines, name, help_text, histograms):
+        lines.append(f'# HELP {name} {help_text}')
+        lines.append(f'# TYPE {name} histogram')
+        for endpoint, histogram in sorted(histograms.items()):
+            label = f'endpoint="{_label(endpoint)}"'
+            for bound, count in zip(histogram.buckets, histogram.counts):
+                lines.append(f'{name}_bucket{{{label},le="{bound}"}} {count}')
+            lines.append(f'{name}_bucket{{{label},le="+Inf"}} {histogram.total}')
+            lines.append(f'{name}_sum{{{label}}} {histogram.sum:.6f}')
+            lines.append(f'{name}_count{{{label}}} {histogram.total}')
+
+    @staticmethod
+    def _counter_lines(lines, name, help_text, values):
+        lines.append(f'# HELP {name} {help_text}')
+        lines.append(f'# TYPE {name} counter')
+        for endpoint, value in sorted(values.items()):
+            lines.append(f'{name}{{endpoint="{_label(endpoint)}"}} {value}')
+
+
+instrumentation = Instrumentation()
@@ -0,0 +1,105 @@
+from datetime import datetime
+
+from sqlalchemy import inspect, text
+
+from models import db, SchemaMigration
+from search import fts5_ddl, fts5_supported
+
+# Migraciones de esquema versionadas. Cada migración recibe una conexión dentro
+# de una transacción y debe ser idempotente: las bases de datos nuevas ya se
+# crean con el esquema completo mediante create_all() y sólo se marcan como
+# migradas. Para cambiar el esquema se agrega una entrada al final de
+# MIGRATIONS; nunca se modifican las existentes.
+
+
+def add_column(conn, table, column, ddl):
+    columns = {col['name'] for col in inspect(conn).get_columns(table)}
+    if column not in columns:
+        conn.execute(text(f'ALTER TABLE {table} ADD COLUMN {column} {ddl}'))
+
+
+def create_indexes(conn, names):
+    # Crea los índices de models.py con esos nombres si aún no existen. Cada
+    # migración nombra los suyos, para que agregar un índice después no cambie
+    # lo que hace una migración anterior.
+    for table in db.metadata.sorted_tables:
+        for index in table.indexes:
+            if index.name in names:
+                index.create(bind=conn, checkfirst=True)
+
+
+def _trip_request_id(conn):
+    add_column(conn, 'trip', 'request_id', 'INTEGER REFERENCES request (id)')
+
+
+def _query_indexes(conn):
+    create_indexes(conn, (
+        'ix_vehicle_status',
+        'ix_trip_end_time',
+        'ix_trip_start_time',
+        'ix_trip_vehicle_start',
+        'ix_trip_request_id',
+        'ix_request_status_date',
+        'ix_request_user_date',
+        'ix_vehicle_log_vehicle_timestamp',
+        'ix_incident_report_status_date',
+        'ix_incident_report_date',
+    ))
+
+
+def _vehicle_version(conn):
+    add_column(conn, 'vehicle', 'version', 'INTEGER NOT NULL DEFAULT 0')
+
+
+def _request_window(conn):
+    add_column(conn, 'request', 'start_time', 'DATETIME')
+    add_column(conn, 'request', 'end_time', 'DATETIME')
+    create_indexes(conn, ('ix_request_vehicle_start', 'ix_request_status_start'))
+
+
+def _search_index(conn):
+    # Sólo SQLite con FTS5; los demás motores buscan con LIKE (ver search.py)
+    if fts5_supported(conn):
+        for statement in fts5_ddl(('incident_report', 'trip', 'request')):
+            conn.exec_driver_sql(statement)
+
+
+def _archived_trip_search(conn):
+    # Los viajes que `flask archive` mueve a archived_trip siguen en la búsqueda
+    if fts5_supported(conn):
+        for statement in fts5_ddl(('archived_trip',)):
+            conn.exec_driver_sql(statement)
+
+
+MIGRATIONS = [
+    (1, 'Trip.request_id: solicitud que originó el viaje', _trip_request_id),
+    (2, 'Índices para las consultas frecuentes', _query_indexes),
+    (3, 'Vehicle.version: control de concurrencia optimista', _vehicle_version),
+    (4, 'Índice de búsqueda de texto en incidentes, viajes y solicitudes', _search_index),
+    (5, 'Request.start_time/end_time: reservas con horario', _request_window),
+    (6, 'Viajes archivados en el índice de búsqueda', _archived_trip_search),
+]
+
+
+def applied_versions():
+    return {version for (version,) in db.session.query(SchemaMigration.version)}
+
+
+def upgrade_database():
+    # Crea las tablas faltantes y aplica en orden las migraciones pendientes.
+    # Devuelve la lista de migraciones aplicadas.
+    db.create_all()
+    done = applied_versions()
+    db.session.commit()
+    applied = []
+    for version, description, migrate in MIGRATIONS:
+        if version in done:
+            continue
+        with db.engine.begin() as conn:
+            migrate(conn)
+            conn.execute(
+                SchemaMigration.__table__.insert(),
+                {'version': version, 'description': description, 'applied_at': datetime.now()}
+            )
+        applied.append((version, description))
+    return applied
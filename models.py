@@ -1,10 +1,28 @@
+from flask import current_app, has_app_context
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import event
 from werkzeug.security import generate_password_hash, check_password_hash
 from flask_login import UserMixin
 from datetime import datetime
 
 db = SQLAlchemy()
 
+
+def configure_engine(app):
+    # Aplica SQLITE_PRAGMAS (perfil 'sqlite' de config.py) a cada conexión nueva
+    pragmas = app.config.get('SQLITE_PRAGMAS')
+    with app.app_context():
+        engine = db.engine
+    if not pragmas or engine.dialect.name != 'sqlite':
+        return
+
+    @event.listens_for(engine, 'connect')
+    def set_sqlite_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for name, value in pragmas.items():
+            cursor.execute(f'PRAGMA {name}={value}')
+        cursor.close()
+
 class User(UserMixin, db.Model):
     id = db.Column(db.Integer, primary_key=True)
     username = db.Column(db.String(64), unique=True, nullable=False)
@@ -12,7 +30,9 @@ class User(UserMixin, db.Model):
     role = db.Column(db.String(20), default='worker')  # 'admin' o 'worker'
 
     def set_password(self, password):
-        self.password_hash = generate_password_hash(password)
+        # Método y parámetros del hash según PASSWORD_HASH_METHOD
+        method = current_app.config.get('PASSWORD_HASH_METHOD', 'scrypt') if has_app_context() else 'scrypt'
+        self.password_hash = generate_password_hash(password, method=method)
 
     def check_password(self, password):
         return check_password_hash(self.password_hash, password)
@@ -24,6 +44,14 @@ class Vehicle(db.Model):
     model = db.Column(db.String(50), nullable=False)
     status = db.Column(db.String(20), default='available') # 'available', 'in_use', 'maintenance', 'incident'
     current_odometer = db.Column(db.Integer, default=0)
+    # Se incrementa en cada cambio; las actualizaciones del ORM fallan si otra
+    # transacción modificó el vehículo entre la lectura y la escritura
+    version = db.Column(db.Integer, nullable=False, default=0)
+
+    __table_args__ = (
+        db.Index('ix_vehicle_status', 'status'),
+    )
+    __mapper_args__ = {'version_id_col': version}
 
 class Trip(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -39,8 +67,19 @@ class Trip(db.Model):
     end_odometer = db.Column(db.Integer)
     km_traveled = db.Column(db.Integer)
 
+    # Solicitud que originó el viaje (nulo en viajes anteriores sin respaldo)
+    request_id = db.Column(db.Integer, db.ForeignKey('request.id'), nullable=True)
+
     user = db.relationship('User', backref='trips')
     vehicle = db.relationship('Vehicle', backref='trips')
+    request = db.relationship('Request', backref=db.backref('trip', uselist=False))
+
+    __table_args__ = (
+        db.Index('ix_trip_end_time', 'end_time'),
+        db.Index('ix_trip_start_time', 'start_time'),
+        db.Index('ix_trip_vehicle_start', 'vehicle_id', 'start_time'),
+        db.Index('ix_trip_request_id', 'request_id'),
+    )
 
 class Request(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -55,9 +94,20 @@ class Request(db.Model):
     num_auditors = db.Column(db.Integer)
     auditors_names = db.Column(db.Text)
 
+    # Horario reservado (opcional; sin horario la solicitud es para salir ya)
+    start_time = db.Column(db.DateTime, nullable=True)
+    end_time = db.Column(db.DateTime, nullable=True)
+
     user = db.relationship('User', backref='requests')
     vehicle = db.relationship('Vehicle', backref='requests')
 
+    __table_args__ = (
+        db.Index('ix_request_status_date', 'status', 'date_requested'),
+        db.Index('ix_request_user_date', 'user_id', 'date_requested'),
+        db.Index('ix_request_vehicle_start', 'vehicle_id', 'start_time'),
+        db.Index('ix_request_status_start', 'status', 'start_time'),
+    )
+
 class VehicleLog(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     vehicle_id = db.Column(db.Integer, db.ForeignKey('vehicle.id'))
@@ -67,6 +117,10 @@ class VehicleLog(db.Model):
 
     vehicle = db.relationship('Vehicle', backref=db.backref('logs', lazy='dynamic'))
 
+    __table_args__ = (
+        db.Index('ix_vehicle_log_vehicle_timestamp', 'vehicle_id', 'timestamp'),
+    )
+
 class IncidentReport(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     vehicle_id = db.Column(db.Integer, db.ForeignKey('vehicle.id'))
@@ -79,3 +133,103 @@ class IncidentReport(db.Model):
 
     vehicle = db.relationship('Vehicle', backref='incidents')
     user = db.relationship('User', backref='incidents')
+
+    __table_args__ = (
+        db.Index('ix_incident_report_status_date', 'status', 'report_date'),
+        db.Index('ix_incident_report_date', 'report_date'),
+    )
+
+class VehicleDailyUsage(db.Model):
+    # Resumen incremental de viajes completados por vehículo y día de salida
+    __tablename__ = 'vehicle_daily_usage'
+    vehicle_id = db.Column(db.Integer, db.ForeignKey('vehicle.id'), primary_key=True)
+    day = db.Column(db.Date, primary_key=True)
+    month = db.Column(db.Date, nullable=False)  # Primer día del mes de `day`
+    trips = db.Column(db.Integer, nullable=False, default=0)
+    km = db.Column(db.Integer, nullable=False, default=0)
+
+    __table_args__ = (
+        db.Index('ix_vehicle_daily_usage_day', 'day'),
+        db.Index('ix_vehicle_daily_usage_month', 'month'),
+    )
+
+class UserMonthlyUsage(db.Model):
+    # Resumen incremental de viajes completados por trabajador y mes de salida
+    __tablename__ = 'user_monthly_usage'
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    month = db.Column(db.Date, primary_key=True)
+    trips = db.Column(db.Integer, nullable=False, default=0)
+    km = db.Column(db.Integer, nullable=False, default=0)
+
+    __table_args__ = (
+        db.Index('ix_user_monthly_usage_month', 'month'),
+    )
+
+class FleetState(db.Model):
+    # Fila única con un contador que se incrementa en cada cambio de la flota
+    id = db.Column(db.Integer, primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, default=datetime.now)
+
+class FleetEvent(db.Model):
+    # Cambios de estado publicados a /events cuando EVENTS_BROKER='database'
+    __tablename__ = 'fleet_event'
+    id = db.Column(db.Integer, primary_key=True)
+    created_at = db.Column(db.DateTime, default=datetime.now, nullable=False)
+    event_type = db.Column(db.String(50), nullable=False)
+    payload = db.Column(db.Text, nullable=False)
+
+    __table_args__ = (
+        db.Index('ix_fleet_event_created_at', 'created_at'),
+    )
+
+class ArchivedTrip(db.Model):
+    # Viajes completados anteriores a ArchiveState.archived_before; conservan su id
+    __tablename__ = 'archived_trip'
+    id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'))
+    vehicle_id = db.Column(db.Integer, db.ForeignKey('vehicle.id'))
+    destination = db.Column(db.String(200), nullable=False)
+    reason = db.Column(db.String(255), nullable=True)
+    start_time = db.Column(db.DateTime, nullable=False)
+    end_time = db.Column(db.DateTime, nullable=True)
+    start_odometer = db.Column(db.Integer)
+    end_odometer = db.Column(db.Integer)
+    km_traveled = db.Column(db.Integer)
+    request_id = db.Column(db.Integer, db.ForeignKey('request.id'), nullable=True)
+
+    user = db.relationship('User')
+    vehicle = db.relationship('Vehicle')
+    request = db.relationship('Request')
+
+    __table_args__ = (
+        db.Index('ix_archived_trip_start_time', 'start_time'),
+        db.Index('ix_archived_trip_vehicle_start', 'vehicle_id', 'start_time'),
+    )
+
+class ArchivedVehicleLog(db.Model):
+    # Bitácora anterior a ArchiveState.archived_before; conserva su id
+    __tablename__ = 'archived_vehicle_log'
+    id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    vehicle_id = db.Column(db.Integer, db.ForeignKey('vehicle.id'))
+    timestamp = db.Column(db.DateTime)
+    event = db.Column(db.String(100), nullable=False)
+    notes = db.Column(db.String(255))
+
+    __table_args__ = (
+        db.Index('ix_archived_vehicle_log_vehicle_timestamp', 'vehicle_id', 'timestamp'),
+    )
+
+class ArchiveState(db.Model):
+    # Fila única: todo lo anterior a archived_before puede estar en las tablas de archivo
+    __tablename__ = 'archive_state'
+    id = db.Column(db.Integer, primary_key=True)
+    archived_before = db.Column(db.DateTime, nullable=True)
+    updated_at = db.Column(db.DateTime, default=datetime.now)
+
+class SchemaMigration(db.Model):
+    # Migraciones de esquema ya aplicadas (ver migrations.py)
+    __tablename__ = 'schema_migration'
+    version = db.Column(db.Integer, primary_key=True)
+    description = db.Column(db.String(200), nullable=False)
+    applied_at = db.Column(db.DateTime, default=datetime.now)
@@ -0,0 +1,43 @@
+from datetime import datetime
+
+from sqlalchemy import and_, or_
+
+# Paginación por cursor (keyset): cada página continúa después de la última
+# fila mostrada usando (marca de tiempo, id), de modo que el costo no depende
+# de cuántas filas antiguas existan.
+PAGE_SIZE = 50
+
+
+def encode_cursor(timestamp, row_id):
+    return f'{timestamp.isoformat()}_{row_id}'
+
+
+def decode_cursor(value):
+    # Lanza ValueError si el cursor no es válido
+    if not value:
+        return None
+    timestamp, row_id = value.rsplit('_', 1)
+    return datetime.fromisoformat(timestamp), int(row_id)
+
+
+def keyset_query(query, time_column, id_column, cursor=None, page_size=PAGE_SIZE):
+    # Filas posteriores al cursor en orden descendente, con una fila extra para
+    # saber si existe una página siguiente
+    if cursor:
+        timestamp, row_id = cursor
+        query = query.filter(or_(
+            time_column < timestamp,
+            and_(time_column == timestamp, id_column < row_id),
+        ))
+    return query.order_by(time_column.desc(), id_column.desc()).limit(page_size + 1)
+
+
+def keyset_page(query, time_column, id_column, cursor=None, page_size=PAGE_SIZE):
+    # Devuelve (filas, cursor de la siguiente página o None)
+    rows = keyset_query(query, time_column, id_column, cursor, page_size).all()
+    next_cursor = None
+    if len(rows) > page_size:
+        rows = rows[:page_size]
+        last = rows[-1]
+        next_cursor = encode_cursor(getattr(last, time_column.key), getattr(last, id_column.key))
+    return rows, next_cursor
@@ -0,0 +1,83 @@
+import re
+from datetime import date, datetime
+
+from models import db, Trip, VehicleLog, IncidentReport, ArchivedTrip, ArchivedVehicleLog
+from pagination import keyset_query
+from reservations import overlapping_requests, free_vehicles_query
+from reports import report_statement
+from snapshots import (pending_requests_query, active_trips_query, pending_incidents_query,
+                       available_vehicles_query, user_requests_query, upcoming_reservations_query)
+
+# Revisión de los planes de ejecución (EXPLAIN QUERY PLAN de SQLite) de las
+# consultas que usan las rutas. Falla si alguna recorre una tabla completa.
+# No se incluyen el listado de todos los vehículos ni el conteo por estado del
+# panel, que por diseño leen la tabla vehicle completa.
+
+_CURSOR = (datetime(2024, 1, 1), 1)
+_FILTERS = {'desde': date(2024, 1, 1), 'hasta': date(2024, 12, 31), 'vehicle_id': None}
+_VEHICLE_FILTERS = {'desde': None, 'hasta': None, 'vehicle_id': 1}
+_WINDOW = (datetime(2030, 1, 1, 8), datetime(2030, 1, 1, 18))
+
+ROUTE_QUERIES = [
+    ('dashboard', 'solicitudes pendientes', lambda: pending_requests_query().statement),
+    ('dashboard', 'viajes en curso', lambda: active_trips_query().statement),
+    ('dashboard', 'incidentes pendientes', lambda: pending_incidents_query().statement),
+    ('dashboard', 'vehículos disponibles', lambda: available_vehicles_query().statement),
+    ('dashboard', 'solicitudes del trabajador', lambda: user_requests_query(1).statement),
+    ('dashboard', 'reservas próximas', lambda: upcoming_reservations_query().statement),
+    ('request_vehicle', 'reservas traslapadas', lambda: overlapping_requests(1, *_WINDOW).statement),
+    ('availability', 'vehículos libres en un horario', lambda: free_vehicles_query(*_WINDOW).statement),
+    ('report', 'viajes por rango de fechas', lambda: report_statement(_FILTERS)),
+    ('report', 'viajes por vehículo', lambda: report_statement(_VEHICLE_FILTERS)),
+    ('vehicle_details', 'viajes del vehículo',
+     lambda: keyset_query(Trip.query.filter_by(vehicle_id=1), Trip.start_time, Trip.id, _CURSOR).statement),
+    ('vehicle_details', 'eventos del vehículo',
+     lambda: keyset_query(VehicleLog.query.filter_by(vehicle_id=1), VehicleLog.timestamp, VehicleLog.id, _CURSOR).statement),
+    ('report', 'viajes archivados por rango de fechas', lambda: report_statement(_FILTERS, ArchivedTrip)),
+    ('vehicle_details', 'viajes archivados del vehículo',
+     lambda: keyset_query(ArchivedTrip.query.filter_by(vehicle_id=1), ArchivedTrip.start_time, ArchivedTrip.id,
+                          _CURSOR).statement),
+    ('vehicle_details', 'eventos archivados del vehículo',
+     lambda: keyset_query(ArchivedVehicleLog.query.filter_by(vehicle_id=1), ArchivedVehicleLog.timestamp,
+                          ArchivedVehicleLog.id, _CURSOR).statement),
+    ('incident_reports', 'primera página',
+     lambda: keyset_query(IncidentReport.query, IncidentReport.report_date, IncidentReport.id).statement),
+    ('incident_reports', 'página siguiente',
+     lambda: keyset_query(IncidentReport.query, IncidentReport.report_date, IncidentReport.id, _CURSOR).statement),
+]
+
+# "SCAN tabla" sin índice es un recorrido completo. "SCAN ... USING INDEX"
+# recorre el índice entero, así que sólo se acepta si la consulta tiene LIMIT
+# (recorrido ordenado que se detiene en la primera página).
+_FULL_SCAN = re.compile(r'^SCAN (?!CONSTANT ROW)')
+_INDEX_SCAN = re.compile(r'^SCAN .*\bUSING (COVERING )?INDEX\b')
+_LIMIT = re.compile(r'\bLIMIT\b')
+
+
+def _compile(statement):
+    # render_postcompile expande los IN (...) a un parámetro por valor
+    compiled = statement.compile(dialect=db.engine.dialect, compile_kwargs={'render_postcompile': True})
+    return str(compiled), tuple(compiled.params[name] for name in compiled.positiontup)
+
+
+def explain(statement):
+    sql, params = _compile(statement)
+    with db.engine.connect() as conn:
+        rows = conn.exec_driver_sql('EXPLAIN QUERY PLAN ' + sql, params).fetchall()
+    return [row[-1] for row in rows]
+
+
+def full_scans(statement, plan):
+    limited = bool(_LIMIT.search(_compile(statement)[0]))
+    return [detail for detail in plan
+            if _FULL_SCAN.match(detail) and not (limited and _INDEX_SCAN.match(detail))]
+
+
+def check_query_plans():
+    # Devuelve una lista de (ruta, descripción, plan, recorridos completos)
+    results = []
+    for route, description, build in ROUTE_QUERIES:
+        statement = build()
+        plan = explain(statement)
+        results.append((route, description, plan, full_scans(statement, plan)))
+    return results
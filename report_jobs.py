@@ -0,0 +1,239 @@
+import hashlib
+import importlib.util
+import json
+import multiprocessing
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from datetime import datetime
+
+from fleet_state import fleet_version
+from reports import report_filename, write_report_csv, write_report_pdf, write_report_xlsx
+
+# Reportes grandes en segundo plano: la generación corre en un pool de
+# procesos y el resultado queda en disco con una llave sha256 de los filtros,
+# el formato y la versión de la flota. Mientras la flota no cambie, pedir el
+# mismo reporte devuelve el archivo ya generado. Archivar historial no cambia
+# el contenido de los reportes, así que no invalida los archivos.
+#
+# Cada trabajo deja en el directorio <llave>.json (solicitud), <llave>.<ext>
+# (resultado) o <llave>.error, de modo que cualquier worker del servidor puede
+# consultar el estado y descargar el archivo.
+
+# formato: (tipo MIME, paquete opcional que requiere)
+REPORT_FORMATS = {
+    'csv': ('text/csv; charset=utf-8', None),
+    'xlsx': ('application/vnd.openxmlformats-officedocument.spreadsheetml.sheet', 'openpyxl'),
+    'pdf': ('application/pdf', 'reportlab'),
+}
+
+
+class ReportQueueFull(Exception):
+    pass
+
+
+def format_available(fmt):
+    if fmt not in REPORT_FORMATS:
+        return False
+    package = REPORT_FORMATS[fmt][1]
+    return package is None or importlib.util.find_spec(package) is not None
+
+
+def job_key(filters, fmt, version):
+    payload = {
+        'desde': filters['desde'].isoformat() if filters['desde'] else None,
+        'hasta': filters['hasta'].isoformat() if filters['hasta'] else None,
+        'vehicle_id': filters['vehicle_id'],
+        'formato': fmt,
+        'version': version,
+    }
+    return hashlib.sha256(json.dumps(payload, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+# --- Proceso hijo ---
+
+_worker_app = None
+
+
+def _get_worker_app():
+    # Import diferido: app.py importa este módulo
+    global _worker_app
+    if _worker_app is None:
+        from app import app
+        _worker_app = app
+    return _worker_app
+
+
+def _write_atomic(path, write, binary):
+    directory = os.path.dirname(path)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb' if binary else 'w', **({} if binary else {'encoding': 'utf-8', 'newline': ''})) as f:
+            write(f)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+
+
+def _generate_report(filters, fmt, path, error_path):
+    try:
+        with _get_worker_app().app_context():
+            if fmt == 'csv':
+                _write_atomic(path, lambda f: write_report_csv(filters, f), binary=False)
+            elif fmt == 'xlsx':
+                _write_atomic(path, lambda f: write_report_xlsx(filters, f), binary=True)
+            else:
+                _write_atomic(path, lambda f: write_report_pdf(filters, f), binary=True)
+    except Exception as e:
+        _write_atomic(error_path, lambda f: f.write(f'{type(e).__name__}: {e}'), binary=False)
+        raise
+
+
+# --- Proceso web ---
+
+class ReportJobs:
+    def __init__(self):
+        self.directory = None
+        self._executor = None
+        self._slots = None
+        self._pending = {}
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        app.config.setdefault('REPORT_JOBS_DIR', None)
+        app.config.setdefault('REPORT_JOBS_WORKERS', 2)
+        app.config.setdefault('REPORT_JOBS_QUEUE', 8)
+        app.config.setdefault('REPORT_JOBS_TIMEOUT', 1800)
+        app.config.setdefault('REPORT_CACHE_SIZE', 64)
+        self.directory = app.config['REPORT_JOBS_DIR'] or os.path.join(app.instance_path, 'report_jobs')
+        os.makedirs(self.directory, exist_ok=True)
+        self.workers = app.config['REPORT_JOBS_WORKERS']
+        self.timeout = app.config['REPORT_JOBS_TIMEOUT']
+        self.cache_size = app.config['REPORT_CACHE_SIZE']
+        # Trabajos en curso más en espera en este proceso; por encima se rechazan
+        self._slots = threading.BoundedSemaphore(max(self.workers, app.config['REPORT_JOBS_QUEUE']))
+
+    def _executor_for_submit(self):
+        # El pool se crea con el primer trabajo. 'spawn' en lugar de fork: el
+        # proceso web tiene hilos y conexiones abiertas que no deben heredarse.
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(max_workers=self.workers,
+                                                 mp_context=multiprocessing.get_context('spawn'))
+        return self._executor
+
+    def _path(self, key, extension):
+        return os.path.join(self.directory, f'{key}.{extension}')
+
+    def _read_meta(self, key):
+        try:
+            with open(self._path(key, 'json'), encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def submit(self, filters, fmt):
+        # Devuelve la llave del trabajo; si el archivo ya existe no se encola nada
+        key = job_key(filters, fmt, fleet_version())
+        result_path = self._path(key, fmt)
+        if os.path.exists(result_path):
+            os.utime(result_path)
+            return key
+        with self._lock:
+            if key in self._pending:
+                return key
+            if not self._slots.acquire(blocking=False):
+                raise ReportQueueFull()
+            try:
+                meta = {
+                    'formato': fmt,
+                    'filename': report_filename(filters, fmt),
+                    'requested_at': time.time(),
+                }
+                _write_atomic(self._path(key, 'json'), lambda f: json.dump(meta, f), binary=False)
+                if os.path.exists(self._path(key, 'error')):
+                    os.remove(self._path(key, 'error'))
+                future = self._executor_for_submit().submit(
+                    _generate_report, filters, fmt, result_path, self._path(key, 'error')
+                )
+            except BaseException:
+                self._slots.release()
+                raise
+            self._pending[key] = future
+        future.add_done_callback(lambda future: self._finished(key, future))
+        return key
+
+    def _finished(self, key, future):
+        error = future.exception()
+        with self._lock:
+            self._pending.pop(key, None)
+            # Un proceso hijo que muere deja el pool inutilizable; se crea otro
+            if isinstance(error, BrokenProcessPool) and self._executor is not None:
+                self._executor.shutdown(wait=False)
+                self._executor = None
+        self._slots.release()
+        # Si el proceso hijo murió sin escribir el error, se registra aquí
+        if error is not None and not os.path.exists(self._path(key, 'error')):
+            _write_atomic(self._path(key, 'error'), lambda f: f.write(f'{type(error).__name__}: {error}'),
+                          binary=False)
+        self._evict()
+
+    def status(self, key):
+        # None si la llave no corresponde a ningún trabajo
+        meta = self._read_meta(key)
+        if meta is None:
+            return None
+        status = {
+            'key': key,
+            'formato': meta['formato'],
+            'filename': meta['filename'],
+            'requested_at': datetime.fromtimestamp(meta['requested_at']),
+            'state': 'pending',
+            'error': None,
+        }
+        if os.path.exists(self._path(key, meta['formato'])):
+            status['state'] = 'ready'
+        elif os.path.exists(self._path(key, 'error')):
+            with open(self._path(key, 'error'), encoding='utf-8') as f:
+                status['state'], status['error'] = 'failed', f.read()
+        elif key not in self._pending and time.time() - meta['requested_at'] > self.timeout:
+            status['state'], status['error'] = 'failed', 'El trabajo no terminó a tiempo.'
+        return status
+
+    def result_path(self, key):
+        meta = self._read_meta(key)
+        if meta is None:
+            return None, None
+        path = self._path(key, meta['formato'])
+        return (path, meta) if os.path.exists(path) else (None, meta)
+
+    def _evict(self):
+        # Conserva los REPORT_CACHE_SIZE trabajos usados más recientemente
+        entries = []
+        for name in os.listdir(self.directory):
+            if not name.endswith('.json'):
+                continue
+            key = name[:-len('.json')]
+            meta = self._read_meta(key)
+            # La descarga actualiza la fecha del resultado; si no hay, cuenta la solicitud
+            for path in ((self._path(key, meta['formato']),) if meta else ()) + (self._path(key, 'json'),):
+                try:
+                    entries.append((os.path.getmtime(path), key))
+                    break
+                except OSError:
+                    pass
+        entries.sort()
+        for _, key in entries[:max(0, len(entries) - self.cache_size)]:
+            if key in self._pending:
+                continue
+            for extension in ('json', 'error', *REPORT_FORMATS):
+                try:
+                    os.remove(self._path(key, extension))
+                except OSError:
+                    pass
+
+
+report_jobs = ReportJobs()
@@ -0,0 +1,197 @@
+import csv
+import heapq
+import io
+from datetime import date, datetime, timedelta
+
+from sqlalchemy import select
+from sqlalchemy.orm import joinedload
+
+from archive import reaches_archive
+from models import db, Trip, ArchivedTrip
+
+# Número de viajes que se leen del servidor por lote al generar el reporte
+REPORT_BATCH_SIZE = 500
+
+# Columnas del reporte de viajes: (clave, encabezado)
+REPORT_COLUMNS = [
+    ('fecha_salida', 'Fecha de Salida'),
+    ('fecha_regreso', 'Fecha de Regreso'),
+    ('odometro_inicio', 'Odómetro Inicio (km)'),
+    ('odometro_fin', 'Odómetro Fin (km)'),
+    ('km_recorridos', 'Km Recorridos'),
+    ('resguardante', 'Resguardante'),
+    ('placa', 'Placa'),
+    ('marca', 'Marca'),
+    ('modelo', 'Modelo'),
+    ('responsable', 'Responsable'),
+    ('no_auditores', 'No. de Auditores'),
+    ('nombre_auditores', 'Nombres de Auditores'),
+    ('ruta_destino', 'Ruta-Destino'),
+    ('motivo_salida', 'Motivo de Salida'),
+]
+
+
+def parse_report_filters(args):
+    # Filtros opcionales: desde/hasta (AAAA-MM-DD, inclusivos) y vehicle_id.
+    # Lanza ValueError si algún valor no es válido.
+    filters = {'desde': None, 'hasta': None, 'vehicle_id': None}
+    if args.get('desde'):
+        filters['desde'] = datetime.strptime(args['desde'], '%Y-%m-%d').date()
+    if args.get('hasta'):
+        filters['hasta'] = datetime.strptime(args['hasta'], '%Y-%m-%d').date()
+    if args.get('vehicle_id'):
+        filters['vehicle_id'] = int(args['vehicle_id'])
+    if filters['desde'] and filters['hasta'] and filters['desde'] > filters['hasta']:
+        raise ValueError('la fecha inicial es posterior a la final')
+    return filters
+
+
+# Filas que muestra la vista HTML de /report; las exportaciones no tienen tope
+REPORT_VIEW_LIMIT = 1000
+
+
+def view_filters(filters, today=None):
+    # La vista HTML sin fecha inicial muestra sólo el mes en curso (o el mes
+    # de "hasta"); el historial completo queda para las exportaciones
+    if filters['desde']:
+        return filters
+    reference = filters['hasta'] or today or date.today()
+    return {**filters, 'desde': reference.replace(day=1)}
+
+
+def _since(filters):
+    return datetime.combine(filters['desde'], datetime.min.time()) if filters['desde'] else None
+
+
+def report_statement(filters, model=Trip):
+    # model: Trip o ArchivedTrip (mismas columnas)
+    stmt = (
+        select(model)
+        .filter(model.end_time.isnot(None))
+        .options(joinedload(model.user), joinedload(model.vehicle), joinedload(model.request))
+        .order_by(model.start_time, model.id)
+    )
+    if filters['desde']:
+        stmt = stmt.filter(model.start_time >= _since(filters))
+    if filters['hasta']:
+        stmt = stmt.filter(model.start_time < datetime.combine(filters['hasta'] + timedelta(days=1), datetime.min.time()))
+    if filters['vehicle_id']:
+        stmt = stmt.filter(model.vehicle_id == filters['vehicle_id'])
+    return stmt
+
+
+def report_row(trip, request_for_trip):
+    return {
+        'fecha_salida': trip.start_time.strftime('%d/%m/%Y %H:%M:%S'),
+        'fecha_regreso': trip.end_time.strftime('%d/%m/%Y %H:%M:%S') if trip.end_time else 'N/A',
+        'resguardante': trip.user.username,
+        'placa': trip.vehicle.license_plate,
+        'marca': trip.vehicle.make,
+        'modelo': trip.vehicle.model,
+        'odometro_inicio': trip.start_odometer,
+        'odometro_fin': trip.end_odometer,
+        'km_recorridos': trip.km_traveled,
+        'responsable': request_for_trip.responsible_name if request_for_trip else 'N/A',
+        'no_auditores': request_for_trip.num_auditors if request_for_trip else 'N/A',
+        'nombre_auditores': request_for_trip.auditors_names if request_for_trip else 'N/A',
+        'ruta_destino': trip.destination,
+        'motivo_salida': trip.reason
+    }
+
+
+def _iter_trips(stmt, batch_size):
+    result = db.session.execute(stmt.execution_options(yield_per=batch_size))
+    for trips in result.scalars().partitions():
+        yield from trips
+
+
+def iter_report_rows(filters, batch_size=REPORT_BATCH_SIZE):
+    # Recorre los viajes en lotes del lado del servidor sin cargar todo el
+    # historial; si el rango llega al archivo, intercala ambas tablas en orden
+    streams = [_iter_trips(report_statement(filters), batch_size)]
+    if reaches_archive(_since(filters)):
+        streams.append(_iter_trips(report_statement(filters, ArchivedTrip), batch_size))
+    for trip in heapq.merge(*streams, key=lambda trip: (trip.start_time, trip.id)):
+        yield report_row(trip, trip.request)
+
+
+def iter_report_csv(filters):
+    # BOM para que Excel reconozca los acentos al abrir el archivo
+    buffer = io.StringIO()
+    buffer.write('\ufeff')
+    writer = csv.writer(buffer)
+    writer.writerow([header for _, header in REPORT_COLUMNS])
+    for count, row in enumerate(iter_report_rows(filters), start=1):
+        writer.writerow([row[key] for key, _ in REPORT_COLUMNS])
+        if count % REPORT_BATCH_SIZE == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate(0)
+    yield buffer.getvalue()
+
+
+def write_report_xlsx(filters, fileobj):
+    # openpyxl es opcional; en modo write_only las filas se escriben sin mantenerlas en memoria
+    from openpyxl import Workbook
+
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet('Viajes')
+    sheet.append([header for _, header in REPORT_COLUMNS])
+    for row in iter_report_rows(filters):
+        sheet.append([row[key] for key, _ in REPORT_COLUMNS])
+    workbook.save(fileobj)
+
+
+def write_report_csv(filters, fileobj):
+    # fileobj en modo texto con newline=''
+    for chunk in iter_report_csv(filters):
+        fileobj.write(chunk)
+
+
+def write_report_pdf(filters, fileobj):
+    # reportlab es opcional; la tabla se parte en bloques de REPORT_BATCH_SIZE
+    # filas para que el acomodo de cada bloque no crezca con el reporte completo
+    from reportlab.lib import colors
+    from reportlab.lib.pagesizes import landscape, letter
+    from reportlab.lib.styles import getSampleStyleSheet
+    from reportlab.platypus import LongTable, Paragraph, SimpleDocTemplate, TableStyle
+    from xml.sax.saxutils import escape
+
+    styles = getSampleStyleSheet()
+    cell = styles['BodyText'].clone('ReportCell', fontSize=6, leading=7)
+    header = [Paragraph(title, cell) for _, title in REPORT_COLUMNS]
+    table_style = TableStyle([
+        ('BACKGROUND', (0, 0), (-1, 0), colors.lightgrey),
+        ('GRID', (0, 0), (-1, -1), 0.25, colors.grey),
+        ('VALIGN', (0, 0), (-1, -1), 'TOP'),
+    ])
+
+    def table(rows):
+        block = LongTable([header] + rows, repeatRows=1)
+        block.setStyle(table_style)
+        return block
+
+    story = [Paragraph('Historial de Viajes de Vehículos', styles['Title'])]
+    rows = []
+    for row in iter_report_rows(filters):
+        # Paragraph interpreta marcado, así que el texto se escapa
+        rows.append([Paragraph(escape(str(row[key])) if row[key] is not None else '', cell)
+                     for key, _ in REPORT_COLUMNS])
+        if len(rows) == REPORT_BATCH_SIZE:
+            story.append(table(rows))
+            rows = []
+    if rows or len(story) == 1:
+        story.append(table(rows))
+    SimpleDocTemplate(fileobj, pagesize=landscape(letter), leftMargin=20, rightMargin=20,
+                      topMargin=20, bottomMargin=20).build(story)
+
+
+def report_filename(filters, extension):
+    parts = ['reporte_viajes']
+    if filters['desde']:
+        parts.append(filters['desde'].strftime('%Y%m%d'))
+    if filters['hasta']:
+        parts.append(filters['hasta'].strftime('%Y%m%d'))
+    if filters['vehicle_id']:
+        parts.append(f"vehiculo{filters['vehicle_id']}")
+    return '_'.join(parts) + '.' + extension
@@ -0,0 +1,380 @@
+import random
+import time
+from datetime import datetime, timedelta
+
+from flask import current_app
+from sqlalchemy import exists, insert, select, update
+from sqlalchemy.exc import OperationalError
+
+from audit import log_event, log_events
+from events import publish_event
+from fleet_state import bump_fleet_version
+from models import db, User, Vehicle, Trip, Request
+
+# Reserva de vehículos sin bloquear tablas: cada cambio de estado se hace con
+# un UPDATE condicional (compare-and-swap) sobre el estado esperado, y sólo la
+# transacción cuyo UPDATE afecta la fila gana la reserva.
+
+
+class ReservationError(Exception):
+    pass
+
+
+class RequestAlreadyProcessed(ReservationError):
+    pass
+
+
+class VehicleUnavailable(ReservationError):
+    pass
+
+
+class VehicleReserved(ReservationError):
+    # Otra reserva aprobada ocupa el vehículo en ese horario
+    pass
+
+
+class OutsideReservationWindow(ReservationError):
+    pass
+
+
+# --- Reservas con horario ---
+# Una solicitud con start_time/end_time reserva el vehículo para ese intervalo.
+# Si empieza más tarde que RESERVATION_START_GRACE_MINUTES, al aprobarla sólo
+# se aparta el horario; el viaje se inicia después con start_reservation().
+# Las reservas duran a lo sumo RESERVATION_MAX_DAYS, así que las que se
+# traslapan con un intervalo empiezan dentro de [inicio - máximo, fin) y la
+# búsqueda es un rango del índice (vehicle_id, start_time).
+
+
+def _max_duration():
+    return timedelta(days=current_app.config.get('RESERVATION_MAX_DAYS', 14))
+
+
+def starts_later(start_time, now=None):
+    grace = timedelta(minutes=current_app.config.get('RESERVATION_START_GRACE_MINUTES', 30))
+    return start_time is not None and start_time > (now or datetime.now()) + grace
+
+
+def parse_window(form, now=None):
+    # Horario opcional del formulario (datetime-local). Devuelve (inicio, fin)
+    # o (None, None); lanza ValueError con el motivo si no es válido.
+    start, end = form.get('start_time'), form.get('end_time')
+    if not start and not end:
+        return None, None
+    if not start or not end:
+        raise ValueError('Indica la fecha de salida y la de regreso.')
+    try:
+        start = datetime.strptime(start, '%Y-%m-%dT%H:%M')
+        end = datetime.strptime(end, '%Y-%m-%dT%H:%M')
+    except ValueError:
+        raise ValueError('Las fechas del horario no son válidas.')
+    now = now or datetime.now()
+    if end <= start:
+        raise ValueError('La fecha de regreso debe ser posterior a la de salida.')
+    if end <= now:
+        raise ValueError('El horario solicitado ya pasó.')
+    if end - start > _max_duration():
+        raise ValueError(f"Una reserva no puede durar más de {_max_duration().days} días.")
+    return max(start, now.replace(second=0, microsecond=0)), end
+
+
+def _overlap_conditions(model_vehicle_id, start, end, statuses=('approved',)):
+    return (
+        Request.vehicle_id == model_vehicle_id,
+        Request.start_time < end,
+        Request.start_time > start - _max_duration(),
+        Request.end_time > start,
+        Request.status.in_(statuses),
+    )
+
+
+def overlapping_requests(vehicle_id, start, end, statuses=('approved',), exclude_request_id=None):
+    query = Request.query.filter(*_overlap_conditions(vehicle_id, start, end, statuses))
+    if exclude_request_id is not None:
+        query = query.filter(Request.id != exclude_request_id)
+    return query.order_by(Request.start_time, Request.id)
+
+
+def is_reserved(vehicle_id, start, end, exclude_request_id=None):
+    return db.session.query(
+        overlapping_requests(vehicle_id, start, end, exclude_request_id=exclude_request_id).exists()
+    ).scalar()
+
+
+# Vehículos que lista /availability por consulta
+AVAILABILITY_LIMIT = 200
+
+
+def free_vehicles_query(start, end, limit=AVAILABILITY_LIMIT):
+    # Vehículos sin reservas aprobadas en el intervalo: NOT EXISTS correlacionado
+    # que en cada vehículo es una búsqueda acotada en el índice
+    query = Vehicle.query.filter(
+        ~exists().where(*_overlap_conditions(Vehicle.id, start, end)),
+        Vehicle.status != 'incident',
+    )
+    if not starts_later(start):
+        query = query.filter(Vehicle.status == 'available')
+    return query.order_by(Vehicle.license_plate).limit(limit)
+
+
+def lock_vehicle(vehicle_id):
+    # Serializa las reservas del mismo vehículo (FOR UPDATE; SQLite ya
+    # serializa las transacciones que escriben)
+    db.session.execute(select(Vehicle.id).where(Vehicle.id == vehicle_id).with_for_update())
+
+
+def _usage_window(req, now):
+    # Intervalo que ocupa un viaje que empieza ahora
+    return now, max(req.end_time or now, now + timedelta(minutes=1))
+
+
+def claim_vehicle(vehicle_id, from_status='available', to_status='in_use'):
+    result = db.session.execute(
+        update(Vehicle)
+        .where(Vehicle.id == vehicle_id, Vehicle.status == from_status)
+        .values(status=to_status, version=Vehicle.version + 1)
+    )
+    return result.rowcount == 1
+
+
+def claim_request(request_id, to_status):
+    result = db.session.execute(
+        update(Request)
+        .where(Request.id == request_id, Request.status == 'pending')
+        .values(status=to_status)
+    )
+    return result.rowcount == 1
+
+
+def claim_requests(request_ids, to_status):
+    # Versión por lotes de claim_request; devuelve los ids que se cambiaron
+    if not request_ids:
+        return set()
+    if not db.engine.dialect.update_returning:
+        return {request_id for request_id in request_ids if claim_request(request_id, to_status)}
+    return set(db.session.scalars(
+        update(Request)
+        .where(Request.id.in_(request_ids), Request.status == 'pending')
+        .values(status=to_status)
+        .returning(Request.id)
+    ))
+
+
+def claim_vehicles(vehicle_ids):
+    # Versión por lotes de claim_vehicle; devuelve {vehicle_id: odómetro}
+    if not vehicle_ids:
+        return {}
+    if not db.engine.dialect.update_returning:
+        claimed = [vehicle_id for vehicle_id in vehicle_ids if claim_vehicle(vehicle_id)]
+        return dict(db.session.execute(
+            select(Vehicle.id, Vehicle.current_odometer).where(Vehicle.id.in_(claimed))
+        ).all()) if claimed else {}
+    return dict(db.session.execute(
+        update(Vehicle)
+        .where(Vehicle.id.in_(vehicle_ids), Vehicle.status == 'available')
+        .values(status='in_use', version=Vehicle.version + 1)
+        .returning(Vehicle.id, Vehicle.current_odometer)
+    ).all())
+
+
+def _is_transient(error):
+    message = str(error.orig).lower()
+    return 'database is locked' in message or 'deadlock' in message or 'could not serialize' in message
+
+
+def with_retries(operation):
+    # Reintenta operaciones que fallan por bloqueos transitorios de la base de
+    # datos, con espera exponencial acotada. Los conflictos de reserva
+    # (ReservationError) no se reintentan.
+    attempts = current_app.config.get('RESERVATION_RETRIES', 3)
+    delay = current_app.config.get('RESERVATION_RETRY_DELAY', 0.05)
+    for attempt in range(attempts + 1):
+        try:
+            return operation()
+        except OperationalError as e:
+            db.session.rollback()
+            if attempt == attempts or not _is_transient(e):
+                raise
+            time.sleep(delay * (2 ** attempt) * (1 + random.random()))
+
+
+def _open_trip(req):
+    # Crea el viaje de una solicitud cuyo vehículo ya se reservó con claim_vehicle
+    vehicle = db.session.get(Vehicle, req.vehicle_id)
+    db.session.refresh(vehicle)
+    new_trip = Trip(
+        request_id=req.id,
+        user_id=req.user_id,
+        vehicle_id=req.vehicle_id,
+        destination=req.destination,
+        reason=req.reason,
+        start_time=datetime.now(),
+        start_odometer=vehicle.current_odometer
+    )
+    db.session.add(new_trip)
+    db.session.flush()
+    log_event(vehicle.id, 'En uso', f'Asignado a {req.user.username} para viaje a {req.destination}')
+    publish_event('request_approved', request_id=req.id, vehicle_id=vehicle.id, trip_id=new_trip.id,
+                  user_id=req.user_id, status='in_use')
+    return new_trip
+
+
+def approve(request_id):
+    # Aprueba la solicitud y reserva el vehículo en una sola transacción.
+    # Devuelve el viaje creado, o None si sólo se apartó un horario futuro.
+    if not claim_request(request_id, 'approved'):
+        db.session.rollback()
+        raise RequestAlreadyProcessed(request_id)
+
+    req = db.session.get(Request, request_id)
+    now = datetime.now()
+    if starts_later(req.start_time, now):
+        lock_vehicle(req.vehicle_id)
+        if is_reserved(req.vehicle_id, req.start_time, req.end_time, exclude_request_id=req.id):
+            db.session.rollback()
+            raise VehicleReserved(req.vehicle_id)
+        log_event(req.vehicle_id, 'Reservado',
+                  f"Reservado para {req.user.username} del {req.start_time:%d/%m/%Y %H:%M} al {req.end_time:%d/%m/%Y %H:%M}")
+        publish_event('request_reserved', request_id=req.id, vehicle_id=req.vehicle_id, user_id=req.user_id,
+                      start_time=req.start_time, end_time=req.end_time)
+        bump_fleet_version()
+        db.session.commit()
+        return None
+
+    if not claim_vehicle(req.vehicle_id):
+        db.session.rollback()
+        raise VehicleUnavailable(req.vehicle_id)
+    if is_reserved(req.vehicle_id, *_usage_window(req, now), exclude_request_id=req.id):
+        db.session.rollback()
+        raise VehicleReserved(req.vehicle_id)
+    new_trip = _open_trip(req)
+    bump_fleet_version()
+    db.session.commit()
+    return new_trip
+
+
+def start_reservation(request_id):
+    # Inicia el viaje de una reserva aprobada cuando llega su horario
+    req = db.session.get(Request, request_id)
+    if not req or req.status != 'approved' or req.start_time is None or req.trip is not None:
+        db.session.rollback()
+        raise RequestAlreadyProcessed(request_id)
+    now = datetime.now()
+    if starts_later(req.start_time, now) or req.end_time <= now:
+        db.session.rollback()
+        raise OutsideReservationWindow(request_id)
+    if not claim_vehicle(req.vehicle_id):
+        db.session.rollback()
+        raise VehicleUnavailable(req.vehicle_id)
+    new_trip = _open_trip(req)
+    bump_fleet_version()
+    db.session.commit()
+    return new_trip
+
+
+def reject(request_id):
+    if not claim_request(request_id, 'rejected'):
+        db.session.rollback()
+        raise RequestAlreadyProcessed(request_id)
+    publish_event('request_rejected', request_id=request_id)
+    bump_fleet_version()
+    db.session.commit()
+
+
+BATCH_MAX_REQUESTS = 500
+
+
+def _reserve_in_batch(row):
+    # Aparta el horario futuro de una solicitud del lote; las reservas
+    # anteriores del mismo lote ya son visibles en la transacción
+    if not claim_request(row.id, 'approved'):
+        return 'already_processed'
+    lock_vehicle(row.vehicle_id)
+    if is_reserved(row.vehicle_id, row.start_time, row.end_time, exclude_request_id=row.id):
+        db.session.execute(update(Request).where(Request.id == row.id).values(status='pending'))
+        return 'vehicle_reserved'
+    log_event(row.vehicle_id, 'Reservado',
+              f"Reservado para {row.username} del {row.start_time:%d/%m/%Y %H:%M} al {row.end_time:%d/%m/%Y %H:%M}")
+    publish_event('request_reserved', request_id=row.id, vehicle_id=row.vehicle_id, user_id=row.user_id,
+                  start_time=row.start_time, end_time=row.end_time)
+    return 'reserved'
+
+
+def process_batch(request_ids, action):
+    # Aprueba o rechaza varias solicitudes en una sola transacción. Si varias
+    # solicitudes del lote piden el mismo vehículo gana la más antigua y las
+    # demás siguen pendientes. Devuelve el resultado de cada solicitud en el
+    # orden recibido: (request_id, resultado, datos de la solicitud o None).
+    request_ids = list(dict.fromkeys(request_ids))[:BATCH_MAX_REQUESTS]
+    rows = db.session.execute(
+        select(Request.id, Request.user_id, Request.vehicle_id, Request.destination, Request.reason,
+               Request.status, Request.start_time, Request.end_time, User.username, Vehicle.license_plate)
+        .outerjoin(User, User.id == Request.user_id)
+        .outerjoin(Vehicle, Vehicle.id == Request.vehicle_id)
+        .where(Request.id.in_(request_ids))
+        .order_by(Request.date_requested, Request.id)
+    ).all()
+    found = {row.id: row for row in rows}
+    outcomes = {}
+
+    if action == 'reject':
+        rejected = claim_requests([row.id for row in rows if row.status == 'pending'], 'rejected')
+        for request_id in rejected:
+            outcomes[request_id] = 'rejected'
+            publish_event('request_rejected', request_id=request_id)
+    else:
+        now = datetime.now()
+        winners = {}
+        for row in rows:
+            if row.status != 'pending':
+                continue
+            if starts_later(row.start_time, now):
+                outcomes[row.id] = _reserve_in_batch(row)
+            elif row.vehicle_id in winners:
+                outcomes[row.id] = 'conflict'
+            else:
+                winners[row.vehicle_id] = row
+        approved = claim_requests([row.id for row in winners.values()], 'approved')
+        odometers = claim_vehicles([row.vehicle_id for row in winners.values() if row.id in approved])
+        # Con el vehículo ya bloqueado se descartan los que tienen una reserva
+        # de otra solicitud en curso; vuelven a estar disponibles
+        reserved = [row for row in winners.values() if row.vehicle_id in odometers
+                    and is_reserved(row.vehicle_id, *_usage_window(row, now), exclude_request_id=row.id)]
+        if reserved:
+            db.session.execute(update(Vehicle).where(Vehicle.id.in_([row.vehicle_id for row in reserved]))
+                               .values(status='available', version=Vehicle.version + 1))
+        for row in reserved:
+            del odometers[row.vehicle_id]
+            outcomes[row.id] = 'vehicle_reserved'
+        # Sin vehículo disponible la solicitud vuelve a quedar pendiente
+        unavailable = [row.id for row in winners.values() if row.id in approved and row.vehicle_id not in odometers]
+        if unavailable:
+            db.session.execute(update(Request).where(Request.id.in_(unavailable)).values(status='pending'))
+        for request_id in unavailable:
+            outcomes.setdefault(request_id, 'vehicle_unavailable')
+
+        assigned = [row for row in winners.values() if row.vehicle_id in odometers]
+        if assigned:
+            now = datetime.now()
+            trip_rows = [{'request_id': row.id, 'user_id': row.user_id, 'vehicle_id': row.vehicle_id,
+                          'destination': row.destination, 'reason': row.reason, 'start_time': now,
+                          'start_odometer': odometers[row.vehicle_id]} for row in assigned]
+            if db.engine.dialect.insert_returning:
+                trip_ids = dict(db.session.execute(insert(Trip).returning(Trip.request_id, Trip.id), trip_rows).all())
+            else:
+                db.session.execute(insert(Trip), trip_rows)
+                trip_ids = dict(db.session.execute(
+                    select(Trip.request_id, Trip.id).where(Trip.request_id.in_([row.id for row in assigned]))
+                ).all())
+            log_events([(row.vehicle_id, 'En uso', f'Asignado a {row.username} para viaje a {row.destination}')
+                        for row in assigned])
+            for row in assigned:
+                outcomes[row.id] = 'approved'
+                publish_event('request_approved', request_id=row.id, vehicle_id=row.vehicle_id,
+                              trip_id=trip_ids[row.id], user_id=row.user_id, status='in_use')
+
+    if any(outcome in ('approved', 'rejected', 'reserved') for outcome in outcomes.values()):
+        bump_fleet_version()
+    db.session.commit()
+    return [(request_id, outcomes.get(request_id, 'already_processed' if request_id in found else 'not_found'),
+             found.get(request_id)) for request_id in request_ids]
@@ -0,0 +1,175 @@
+from datetime import date, datetime
+
+from sqlalchemy import Date, cast, delete, distinct, func, insert, select, union_all, update
+from sqlalchemy.exc import IntegrityError
+
+from models import db, User, Vehicle, Trip, ArchivedTrip, VehicleDailyUsage, UserMonthlyUsage
+
+# Estadísticas de uso de la flota a partir de tablas de resumen que
+# complete_trip actualiza en la misma transacción. Las consultas de la página
+# de estadísticas sólo leen estos resúmenes, nunca la tabla trip.
+
+TOP_LIMIT = 50
+
+
+def _as_date(value):
+    # SQLite devuelve date() como texto
+    return date.fromisoformat(value) if isinstance(value, str) else value
+
+
+def month_start(day):
+    return day.replace(day=1)
+
+
+def _upsert(model, keys, values, increments):
+    # INSERT ... ON CONFLICT DO UPDATE: dos viajes completados a la vez para el
+    # mismo vehículo/día no pueden insertar la misma fila dos veces
+    dialect = db.engine.dialect.name
+    if dialect in ('sqlite', 'postgresql'):
+        if dialect == 'sqlite':
+            from sqlalchemy.dialects.sqlite import insert as dialect_insert
+        else:
+            from sqlalchemy.dialects.postgresql import insert as dialect_insert
+        stmt = dialect_insert(model).values(**values)
+        return stmt.on_conflict_do_update(
+            index_elements=list(keys),
+            set_={name: getattr(model, name) + stmt.excluded[name] for name in increments},
+        )
+    if dialect in ('mysql', 'mariadb'):
+        from sqlalchemy.dialects.mysql import insert as dialect_insert
+        stmt = dialect_insert(model).values(**values)
+        return stmt.on_duplicate_key_update(
+            {name: getattr(model, name) + stmt.inserted[name] for name in increments}
+        )
+    return None
+
+
+def _add(model, keys, trips, km, **columns):
+    stmt = _upsert(model, keys, {'trips': trips, 'km': km, **keys, **columns}, ('trips', 'km'))
+    if stmt is not None:
+        db.session.execute(stmt)
+        return
+    # Otros motores: UPDATE y, si no había fila, INSERT en un savepoint; si
+    # otra transacción la insertó primero, se repite el UPDATE
+    condition = [getattr(model, name) == value for name, value in keys.items()]
+    increment = update(model).where(*condition).values(trips=model.trips + trips, km=model.km + km)
+    if db.session.execute(increment).rowcount:
+        return
+    try:
+        with db.session.begin_nested():
+            db.session.execute(insert(model).values(trips=trips, km=km, **keys, **columns))
+    except IntegrityError:
+        db.session.execute(increment)
+
+
+def record_trip_usage(trip):
+    # Se llama desde complete_trip antes del commit
+    day = trip.start_time.date()
+    km = trip.km_traveled or 0
+    _add(VehicleDailyUsage, {'vehicle_id': trip.vehicle_id, 'day': day}, 1, km, month=month_start(day))
+    _add(UserMonthlyUsage, {'user_id': trip.user_id, 'month': month_start(day)}, 1, km)
+
+
+def _day(column):
+    # Fecha (sin hora) y primer día del mes, en el SQL de cada motor
+    if db.engine.dialect.name == 'sqlite':
+        return func.date(column)
+    return cast(column, Date)
+
+
+def _month(column):
+    dialect = db.engine.dialect.name
+    if dialect == 'sqlite':
+        return func.date(column, 'start of month')
+    if dialect == 'postgresql':
+        return cast(func.date_trunc('month', column), Date)
+    return cast(func.date_format(column, '%Y-%m-01'), Date)
+
+
+def rebuild_rollups():
+    # Recalcula los resúmenes desde cero con INSERT ... SELECT ... GROUP BY,
+    # incluidos los viajes ya archivados; las filas no pasan por Python
+    completed = union_all(*[
+        select(model.vehicle_id, model.user_id, model.start_time, model.km_traveled).where(model.end_time.isnot(None))
+        for model in (Trip, ArchivedTrip)
+    ]).subquery()
+    day, month = _day(completed.c.start_time), _month(completed.c.start_time)
+    trips, km = func.count(), func.coalesce(func.sum(completed.c.km_traveled), 0)
+    db.session.execute(delete(VehicleDailyUsage))
+    db.session.execute(delete(UserMonthlyUsage))
+
+    vehicle_days = db.session.execute(insert(VehicleDailyUsage).from_select(
+        ['vehicle_id', 'day', 'month', 'trips', 'km'],
+        select(completed.c.vehicle_id, day, month, trips, km).group_by(completed.c.vehicle_id, day, month)
+    )).rowcount
+    user_months = db.session.execute(insert(UserMonthlyUsage).from_select(
+        ['user_id', 'month', 'trips', 'km'],
+        select(completed.c.user_id, month, trips, km).group_by(completed.c.user_id, month)
+    )).rowcount
+    db.session.commit()
+    return vehicle_days, user_months
+
+
+def parse_period(args):
+    # desde/hasta en formato AAAA-MM (inclusivos); por omisión los últimos 12 meses.
+    # Lanza ValueError si algún valor no es válido.
+    today = date.today()
+    hasta = datetime.strptime(args['hasta'], '%Y-%m').date() if args.get('hasta') else month_start(today)
+    if args.get('desde'):
+        desde = datetime.strptime(args['desde'], '%Y-%m').date()
+    else:
+        desde = date(hasta.year - 1, hasta.month, 1)
+        desde = date(desde.year + (desde.month == 12), desde.month % 12 + 1, 1)
+    if desde > hasta:
+        raise ValueError('el mes inicial es posterior al final')
+    return desde, hasta
+
+
+def _period_days(desde, hasta):
+    next_month = date(hasta.year + (hasta.month == 12), hasta.month % 12 + 1, 1)
+    return (next_month - desde).days
+
+
+def fleet_statistics(desde, hasta):
+    in_period = VehicleDailyUsage.month.between(desde, hasta)
+
+    monthly = [
+        {'month': _as_date(month).strftime('%Y-%m'), 'trips': trips, 'km': km, 'vehicles': vehicles}
+        for month, trips, km, vehicles in db.session.query(
+            VehicleDailyUsage.month, func.sum(VehicleDailyUsage.trips), func.sum(VehicleDailyUsage.km),
+            func.count(distinct(VehicleDailyUsage.vehicle_id))
+        ).filter(in_period).group_by(VehicleDailyUsage.month).order_by(VehicleDailyUsage.month)
+    ]
+
+    period_days = _period_days(desde, hasta)
+    km_total = func.sum(VehicleDailyUsage.km)
+    vehicles = [
+        {'vehicle_id': vehicle_id, 'license_plate': plate, 'make': make, 'model': model,
+         'trips': trips, 'km': km, 'days_used': days,
+         'utilization': round(100 * days / period_days, 1)}
+        for vehicle_id, plate, make, model, trips, km, days in db.session.query(
+            VehicleDailyUsage.vehicle_id, Vehicle.license_plate, Vehicle.make, Vehicle.model,
+            func.sum(VehicleDailyUsage.trips), km_total, func.count(VehicleDailyUsage.day)
+        ).join(Vehicle, Vehicle.id == VehicleDailyUsage.vehicle_id).filter(in_period)
+        .group_by(VehicleDailyUsage.vehicle_id, Vehicle.license_plate, Vehicle.make, Vehicle.model)
+        .order_by(km_total.desc()).limit(TOP_LIMIT)
+    ]
+
+    user_km = func.sum(UserMonthlyUsage.km)
+    workers = [
+        {'user_id': user_id, 'username': username, 'trips': trips, 'km': km}
+        for user_id, username, trips, km in db.session.query(
+            UserMonthlyUsage.user_id, User.username, func.sum(UserMonthlyUsage.trips), user_km
+        ).join(User, User.id == UserMonthlyUsage.user_id)
+        .filter(UserMonthlyUsage.month.between(desde, hasta))
+        .group_by(UserMonthlyUsage.user_id, User.username)
+        .order_by(user_km.desc()).limit(TOP_LIMIT)
+    ]
+
+    return {
+        'desde': desde.strftime('%Y-%m'),
+        'hasta': hasta.strftime('%Y-%m'),
+        'monthly': monthly,
+        'vehicles': vehicles,
+        'workers': workers,
+    }
@@ -0,0 +1,192 @@
+import re
+
+from markupsafe import Markup, escape
+from sqlalchemy import and_, or_, text
+from sqlalchemy.orm import joinedload
+
+from models import db, Trip, ArchivedTrip, Request, IncidentReport
+
+# Búsqueda de texto en incidentes, viajes y solicitudes. En SQLite se usa un
+# índice FTS5 (tabla search_index) que mantienen al día triggers de la base de
+# datos, así que también cubre las inserciones masivas que no pasan por el ORM.
+# En otros motores, o si SQLite no tiene FTS5, se busca con LIKE.
+
+SEARCH_PAGE_SIZE = 20
+SEARCH_MAX_PAGES = 50
+
+# El rowid del índice codifica el tipo y el id del registro (id * 4 + código)
+# para actualizar y borrar entradas sin recorrer la tabla virtual. Los viajes
+# archivados conservan su id y se indexan como 'trip' con el código 0, así que
+# un viaje sigue en la búsqueda después de `flask archive`.
+KIND_CODES = {'incident': 1, 'trip': 2, 'request': 3}
+ARCHIVED_TRIP_CODE = 0
+KIND_LABELS = {'incident': 'Incidente', 'trip': 'Viaje', 'request': 'Solicitud'}
+
+_TRIP_SOURCE = ("coalesce({0}.destination, '')", "coalesce({0}.reason, '')", 'destination, reason')
+
+_SOURCES = {
+    # tabla: (tipo, código, expresión del título, expresión del cuerpo, columnas que disparan la actualización)
+    'incident_report': ('incident', KIND_CODES['incident'],
+                        "coalesce({0}.incident_type, '') || ' ' || coalesce({0}.location, '')",
+                        "coalesce({0}.description, '')",
+                        'incident_type, location, description'),
+    'trip': ('trip', KIND_CODES['trip'], *_TRIP_SOURCE),
+    'request': ('request', KIND_CODES['request'],
+                "coalesce({0}.destination, '')",
+                "coalesce({0}.reason, '') || ' ' || coalesce({0}.auditors_names, '')",
+                'destination, reason, auditors_names'),
+    'archived_trip': ('trip', ARCHIVED_TRIP_CODE, *_TRIP_SOURCE),
+}
+
+
+def fts5_ddl(tables):
+    # Sentencias para crear el índice y, para cada tabla indicada, sus triggers
+    # y la carga de los datos existentes
+    statements = [
+        "CREATE VIRTUAL TABLE IF NOT EXISTS search_index USING fts5("
+        "kind UNINDEXED, title, body, tokenize='unicode61 remove_diacritics 2')"
+    ]
+    for table in tables:
+        kind, code, title, body, columns = _SOURCES[table]
+        insert_new = (f"INSERT INTO search_index (rowid, kind, title, body) VALUES "
+                      f"(new.id * 4 + {code}, '{kind}', {title.format('new')}, {body.format('new')});")
+        delete_old = f"DELETE FROM search_index WHERE rowid = old.id * 4 + {code};"
+        statements += [
+            f"CREATE TRIGGER IF NOT EXISTS {table}_search_insert AFTER INSERT ON {table} "
+            f"BEGIN {insert_new} END",
+            f"CREATE TRIGGER IF NOT EXISTS {table}_search_update AFTER UPDATE OF {columns} ON {table} "
+            f"BEGIN {delete_old} {insert_new} END",
+            f"CREATE TRIGGER IF NOT EXISTS {table}_search_delete AFTER DELETE ON {table} "
+            f"BEGIN {delete_old} END",
+            f"INSERT INTO search_index (rowid, kind, title, body) "
+            f"SELECT id * 4 + {code}, '{kind}', {title.format(table)}, {body.format(table)} FROM {table} "
+            f"WHERE id * 4 + {code} NOT IN (SELECT rowid FROM search_index)",
+        ]
+    return statements
+
+
+def fts5_supported(conn):
+    if conn.dialect.name != 'sqlite':
+        return False
+    return bool(conn.exec_driver_sql("SELECT sqlite_compileoption_used('ENABLE_FTS5')").scalar())
+
+
+def has_search_index():
+    if db.engine.dialect.name != 'sqlite':
+        return False
+    return db.session.execute(
+        text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'search_index'")
+    ).first() is not None
+
+
+def _terms(query):
+    return [term for term in re.findall(r'\w+', query.lower()) if len(term) > 1][:10]
+
+
+def _match_expression(terms):
+    # Cada palabra entre comillas (sin operadores de FTS5); la última admite
+    # prefijo para encontrar "Apiz" mientras se escribe
+    quoted = [f'"{term}"' for term in terms]
+    quoted[-1] += '*'
+    return ' '.join(quoted)
+
+
+def _fts_hits(terms, kind, offset, limit):
+    sql = ("SELECT rowid, kind, snippet(search_index, 2, char(2), char(3), '…', 12) "
+           "FROM search_index WHERE search_index MATCH :match")
+    params = {'match': _match_expression(terms), 'limit': limit, 'offset': offset}
+    if kind:
+        sql += ' AND kind = :kind'
+        params['kind'] = kind
+    # bm25 con más peso para el título (destino, lugar, tipo de incidente)
+    sql += ' ORDER BY bm25(search_index, 0.0, 2.0, 1.0) LIMIT :limit OFFSET :offset'
+    return [(kind, rowid // 4, snippet) for rowid, kind, snippet in db.session.execute(text(sql), params)]
+
+
+_LIKE_COLUMNS = (
+    ('incident', IncidentReport, (IncidentReport.incident_type, IncidentReport.location, IncidentReport.description),
+     IncidentReport.report_date),
+    ('trip', Trip, (Trip.destination, Trip.reason), Trip.start_time),
+    ('trip', ArchivedTrip, (ArchivedTrip.destination, ArchivedTrip.reason), ArchivedTrip.start_time),
+    ('request', Request, (Request.destination, Request.reason, Request.auditors_names), Request.date_requested),
+)
+
+
+def _like_hits(terms, kind, offset, limit):
+    # Sin índice de texto: coincidencia con LIKE en cada tipo, los más recientes primero
+    hits = []
+    for name, model, columns, date_column in _LIKE_COLUMNS:
+        if kind and kind != name:
+            continue
+        conditions = [or_(*[column.ilike(f'%{term}%') for column in columns]) for term in terms]
+        rows = db.session.query(model.id, date_column).filter(and_(*conditions)) \
+            .order_by(date_column.desc(), model.id.desc()).limit(offset + limit)
+        hits += [(date, name, row_id) for row_id, date in rows]
+    hits.sort(key=lambda hit: (hit[0] is not None, hit[0]), reverse=True)
+    return [(name, row_id, None) for _, name, row_id in hits[offset:offset + limit]]
+
+
+def _highlight(snippet):
+    # Las coincidencias vienen marcadas con \x02 y \x03; el resto se escapa
+    if snippet is None:
+        return None
+    return escape(snippet).replace('\x02', Markup('<mark>')).replace('\x03', Markup('</mark>'))
+
+
+def _load_records(hits):
+    # Una consulta por tipo para los registros de la página
+    ids = {}
+    for kind, row_id, _ in hits:
+        ids.setdefault(kind, []).append(row_id)
+    records = {}
+    if 'incident' in ids:
+        for incident in IncidentReport.query.options(joinedload(IncidentReport.vehicle), joinedload(IncidentReport.user)) \
+                .filter(IncidentReport.id.in_(ids['incident'])):
+            records['incident', incident.id] = {
+                'title': f'{incident.incident_type} en {incident.location or "lugar no indicado"}',
+                'date': incident.report_date, 'vehicle': incident.vehicle, 'user': incident.user,
+                'text': incident.description, 'status': incident.status,
+            }
+    if 'trip' in ids:
+        # Los ids que no están en trip se buscan en el archivo
+        for model in (Trip, ArchivedTrip):
+            missing = [row_id for row_id in ids['trip'] if ('trip', row_id) not in records]
+            if not missing:
+                break
+            for trip in model.query.options(joinedload(model.vehicle), joinedload(model.user)) \
+                    .filter(model.id.in_(missing)):
+                records['trip', trip.id] = {
+                    'title': f'Viaje a {trip.destination}', 'date': trip.start_time,
+                    'vehicle': trip.vehicle, 'user': trip.user, 'text': trip.reason,
+                    'status': 'en curso' if trip.end_time is None else 'completado',
+                }
+    if 'request' in ids:
+        for req in Request.query.options(joinedload(Request.vehicle), joinedload(Request.user)) \
+                .filter(Request.id.in_(ids['request'])):
+            records['request', req.id] = {
+                'title': f'Solicitud para {req.destination}', 'date': req.date_requested,
+                'vehicle': req.vehicle, 'user': req.user,
+                'text': f'{req.reason} ({req.auditors_names or ""})', 'status': req.status,
+            }
+    return records
+
+
+def search(query, kind=None, page=1, page_size=SEARCH_PAGE_SIZE):
+    # Devuelve (resultados de la página, hay página siguiente)
+    terms = _terms(query)
+    if not terms:
+        return [], False
+    kind = kind if kind in KIND_CODES else None
+    offset = (page - 1) * page_size
+    find = _fts_hits if has_search_index() else _like_hits
+    hits = find(terms, kind, offset, page_size + 1)
+    has_next = len(hits) > page_size and page < SEARCH_MAX_PAGES
+    hits = hits[:page_size]
+    records = _load_records(hits)
+    results = []
+    for kind_name, row_id, snippet in hits:
+        record = records.get((kind_name, row_id))
+        if record:
+            results.append({'kind': kind_name, 'label': KIND_LABELS[kind_name], 'id': row_id,
+                            'snippet': _highlight(snippet), **record})
+    return results, has_next
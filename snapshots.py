@@ -0,0 +1,199 @@
+import os
+import threading
+from datetime import datetime
+
+from flask import current_app
+from sqlalchemy import func
+from sqlalchemy.orm import joinedload
+
+from cache import LRUCache, FileCache
+from fleet_state import fleet_version
+from models import db, Vehicle, Trip, Request, IncidentReport
+
+# Datos del panel de control como estructuras simples (dict/list) cargadas con
+# un número fijo de consultas; las plantillas no disparan cargas perezosas.
+
+
+def _user_data(user):
+    return {'id': user.id, 'username': user.username}
+
+
+def _vehicle_data(vehicle):
+    return {
+        'id': vehicle.id,
+        'license_plate': vehicle.license_plate,
+        'make': vehicle.make,
+        'model': vehicle.model,
+        'status': vehicle.status,
+        'current_odometer': vehicle.current_odometer,
+    }
+
+
+def _request_data(req):
+    return {
+        'id': req.id,
+        'status': req.status,
+        'destination': req.destination,
+        'reason': req.reason,
+        'date_requested': req.date_requested,
+        'start_time': req.start_time,
+        'end_time': req.end_time,
+        'user': _user_data(req.user),
+        'vehicle': _vehicle_data(req.vehicle),
+    }
+
+
+def _trip_data(trip):
+    return {
+        'id': trip.id,
+        'destination': trip.destination,
+        'start_time': trip.start_time,
+        'start_odometer': trip.start_odometer,
+        'user': _user_data(trip.user),
+        'vehicle': _vehicle_data(trip.vehicle),
+    }
+
+
+def _incident_data(incident):
+    return {
+        'id': incident.id,
+        'incident_type': incident.incident_type,
+        'status': incident.status,
+        'report_date': incident.report_date,
+        'user': _user_data(incident.user),
+        'vehicle': _vehicle_data(incident.vehicle),
+    }
+
+
+def pending_requests_query():
+    return Request.query.filter_by(status='pending') \
+        .options(joinedload(Request.user), joinedload(Request.vehicle)) \
+        .order_by(Request.date_requested, Request.id)
+
+
+def upcoming_reservations_query(limit=50):
+    # Reservas aprobadas cuyo viaje todavía no se inicia
+    return Request.query.filter(
+        Request.status == 'approved',
+        Request.start_time.isnot(None),
+        Request.end_time > datetime.now(),
+        ~Request.trip.has(),
+    ).options(joinedload(Request.user), joinedload(Request.vehicle)) \
+        .order_by(Request.start_time, Request.id).limit(limit)
+
+
+def active_trips_query():
+    return Trip.query.filter(Trip.end_time.is_(None)) \
+        .options(joinedload(Trip.user), joinedload(Trip.vehicle)) \
+        .order_by(Trip.start_time, Trip.id)
+
+
+def pending_incidents_query():
+    return IncidentReport.query.filter_by(status='pending') \
+        .options(joinedload(IncidentReport.user), joinedload(IncidentReport.vehicle)) \
+        .order_by(IncidentReport.report_date, IncidentReport.id)
+
+
+def available_vehicles_query():
+    return Vehicle.query.filter_by(status='available').order_by(Vehicle.id)
+
+
+def user_requests_query(user_id):
+    return Request.query.filter_by(user_id=user_id) \
+        .options(joinedload(Request.user), joinedload(Request.vehicle)) \
+        .order_by(Request.date_requested.desc())
+
+
+def admin_snapshot():
+    # Seis consultas sin importar el tamaño de la flota
+    pending_requests = pending_requests_query().all()
+    reservations = upcoming_reservations_query().all()
+    active_trips = active_trips_query().all()
+    all_vehicles = Vehicle.query.order_by(Vehicle.id).all()
+    pending_incidents = pending_incidents_query().all()
+    status_counts = dict(
+        db.session.query(Vehicle.status, func.count(Vehicle.id)).group_by(Vehicle.status).all()
+    )
+
+    return {
+        'requests': [_request_data(req) for req in pending_requests],
+        'reservations': [_request_data(req) for req in reservations],
+        'active_trips': [_trip_data(trip) for trip in active_trips],
+        'all_vehicles': [_vehicle_data(vehicle) for vehicle in all_vehicles],
+        'pending_incidents': [_incident_data(incident) for incident in pending_incidents],
+        'status_counts': status_counts,
+    }
+
+
+def available_vehicles_snapshot():
+    return [_vehicle_data(vehicle) for vehicle in available_vehicles_query().all()]
+
+
+def user_requests_snapshot(user_id):
+    return [_request_data(req) for req in user_requests_query(user_id).all()]
+
+
+def worker_snapshot(user_id):
+    return {
+        'vehicles': available_vehicles_snapshot(),
+        'my_requests': user_requests_snapshot(user_id),
+    }
+
+
+class SnapshotCache:
+    # Guarda las instantáneas del panel bajo la versión actual de la flota.
+    # Las rutas que modifican la flota incrementan la versión, de modo que las
+    # entradas anteriores dejan de consultarse y se desalojan por antigüedad.
+    def __init__(self):
+        self._locks = {}
+        self._locks_guard = threading.Lock()
+
+    def init_app(self, app):
+        app.config.setdefault('DASHBOARD_CACHE_BACKEND', 'memory')
+        app.config.setdefault('DASHBOARD_CACHE_SIZE', 256)
+        app.config.setdefault('DASHBOARD_CACHE_DIR', None)
+        size = app.config['DASHBOARD_CACHE_SIZE']
+        if app.config['DASHBOARD_CACHE_BACKEND'] == 'file':
+            directory = app.config['DASHBOARD_CACHE_DIR'] or os.path.join(app.instance_path, 'dashboard_cache')
+            backend = FileCache(directory, maxsize=size)
+        else:
+            backend = LRUCache(maxsize=size)
+        app.extensions['snapshot_cache'] = backend
+
+    @property
+    def backend(self):
+        return current_app.extensions['snapshot_cache']
+
+    def fetch(self, key, loader, version=None):
+        if version is None:
+            version = fleet_version()
+        versioned_key = (key, version)
+        value = self.backend.get(versioned_key)
+        if value is None:
+            # Sólo un hilo por clave recalcula la instantánea; los demás esperan
+            # y leen el resultado, evitando la avalancha al inicio del turno.
+            with self._lock_for(key):
+                value = self.backend.get(versioned_key)
+                if value is None:
+                    value = loader()
+                    self.backend.set(versioned_key, value)
+        return value
+
+    def _lock_for(self, key):
+        with self._locks_guard:
+            return self._locks.setdefault(key, threading.Lock())
+
+    def admin(self, version=None):
+        return self.fetch('admin', admin_snapshot, version)
+
+    def worker(self, user_id, version=None):
+        # La lista de vehículos disponibles se comparte entre todos los trabajadores
+        if version is None:
+            version = fleet_version()
+        return {
+            'vehicles': self.fetch('available_vehicles', available_vehicles_snapshot, version),
+            'my_requests': self.fetch(('user_requests', user_id), lambda: user_requests_snapshot(user_id), version),
+        }
+
+
+snapshot_cache = SnapshotCache()
@@ -0,0 +1,78 @@
+from contextlib import contextmanager
+from datetime import datetime
+
+from sqlalchemy import event
+
+from fleet_state import bump_fleet_version
+from models import db, User, Vehicle, Trip, Request, IncidentReport
+from snapshots import admin_snapshot
+
+
+@contextmanager
+def count_queries():
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(db.engine, 'before_cursor_execute', before_cursor_execute)
+    try:
+        yield statements
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', before_cursor_execute)
+
+
+def add_fleet(count):
+    # Por vehículo: una solicitud pendiente, un viaje en curso y un incidente
+    worker = User.query.filter_by(username='worker').one()
+    start = Vehicle.query.count()
+    for n in range(start, start + count):
+        vehicle = Vehicle(license_plate=f'T{n:04d}', make='Nissan', model='Tsuru',
+                          current_odometer=1000, status='in_use')
+        db.session.add(vehicle)
+        db.session.flush()
+        db.session.add_all([
+            Request(user_id=worker.id, vehicle_id=vehicle.id, destination=f'Destino {n}', reason='Auditoría',
+                    status='pending', date_requested=datetime.now()),
+            Trip(user_id=worker.id, vehicle_id=vehicle.id, start_odometer=1000, destination=f'Destino {n}',
+                 reason='Auditoría', start_time=datetime.now()),
+            IncidentReport(vehicle_id=vehicle.id, user_id=worker.id, incident_type='Falla',
+                           description='Ruido en el motor', status='pending', report_date=datetime.now()),
+        ])
+    db.session.commit()
+
+
+def snapshot_query_count():
+    db.session.expunge_all()
+    with count_queries() as statements:
+        snapshot = admin_snapshot()
+    return len(statements), snapshot
+
+
+def dashboard_query_count(client):
+    # Una versión nueva de la flota obliga a reconstruir la instantánea
+    bump_fleet_version()
+    db.session.commit()
+    with count_queries() as statements:
+        response = client.get('/dashboard')
+    assert response.status_code == 200
+    return len(statements)
+
+
+def test_admin_snapshot_query_count_does_not_grow_with_fleet(app):
+    add_fleet(3)
+    small, snapshot = snapshot_query_count()
+    assert len(snapshot['all_vehicles']) == 3
+    add_fleet(40)
+    large, snapshot = snapshot_query_count()
+    assert len(snapshot['all_vehicles']) == 43
+    assert len(snapshot['requests']) == 43
+    assert small == large
+
+
+def test_admin_dashboard_query_count_does_not_grow_with_fleet(app, admin_client):
+    add_fleet(3)
+    small = dashboard_query_count(admin_client)
+    add_fleet(40)
+    large = dashboard_query_count(admin_client)
+    assert small == large
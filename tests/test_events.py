@@ -0,0 +1,41 @@
+from events import DatabaseBroker, LocalBroker
+from models import db, FleetEvent
+
+
+def add_events(count):
+    db.session.add_all([FleetEvent(event_type='vehicle_status', payload='{"vehicle_id": %d}' % n)
+                        for n in range(count)])
+    db.session.commit()
+
+
+def drain(subscription):
+    items = []
+    while (item := subscription.get(timeout=0)) is not None:
+        items.append(item)
+    return items
+
+
+def test_local_broker_replays_only_after_last_event_id(app):
+    broker = LocalBroker()
+    broker.publish_committed([('vehicle_status', {'vehicle_id': n}) for n in range(5)])
+    assert drain(broker.subscribe()) == []
+    assert [item[0] for item in drain(broker.subscribe(last_event_id=3))] == [4, 5]
+
+
+def test_database_broker_does_not_replay_events_committed_while_idle(app, monkeypatch):
+    # Intervalo largo: el hilo lector no corre durante la prueba y la lectura
+    # se hace a mano con poll_once()
+    monkeypatch.setitem(app.config, 'EVENTS_POLL_INTERVAL', 3600)
+    broker = DatabaseBroker(app)
+    subscription = broker.subscribe()
+    subscription.close()
+
+    add_events(5)
+    broker.poll_once()
+
+    fresh = broker.subscribe()
+    assert drain(fresh) == []
+    add_events(1)
+    broker.poll_once()
+    assert len(drain(fresh)) == 1
+    fresh.close()
@@ -0,0 +1,75 @@
+import threading
+from datetime import datetime, timedelta
+
+from models import db, User, Vehicle, Trip, Request
+
+THREADS = 8
+
+
+def add_requests(vehicles, per_vehicle, start_time=None, end_time=None):
+    # Solicitudes pendientes que compiten por los mismos vehículos
+    worker = User.query.filter_by(username='worker').one()
+    request_ids = []
+    for n in range(vehicles):
+        vehicle = Vehicle(license_plate=f'R{n:04d}', make='Nissan', model='Tsuru',
+                          current_odometer=1000, status='available')
+        db.session.add(vehicle)
+        db.session.flush()
+        for k in range(per_vehicle):
+            req = Request(user_id=worker.id, vehicle_id=vehicle.id, destination=f'Destino {k}',
+                          reason='Auditoría', status='pending', start_time=start_time, end_time=end_time)
+            db.session.add(req)
+            db.session.flush()
+            request_ids.append(req.id)
+    db.session.commit()
+    return request_ids
+
+
+def approve_concurrently(app, request_ids):
+    # Cada hilo inicia sesión con su propio cliente y aprueba su parte de las
+    # solicitudes; devuelve los códigos de respuesta y los mensajes de error
+    statuses, errors = [], []
+
+    def approve_all(my_ids):
+        client = app.test_client()
+        client.post('/login', data={'username': 'admin', 'password': 'admin'})
+        for request_id in my_ids:
+            statuses.append(client.get(f'/approve_request/{request_id}').status_code)
+        with client.session_transaction() as session:
+            errors.extend(message for category, message in session.get('_flashes', []) if category == 'danger')
+
+    threads = [threading.Thread(target=approve_all, args=(request_ids[k::THREADS],)) for k in range(THREADS)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return statuses, errors
+
+
+def test_concurrent_approvals_open_one_trip_per_vehicle(app):
+    request_ids = add_requests(vehicles=3, per_vehicle=10)
+    statuses, errors = approve_concurrently(app, request_ids)
+
+    assert len(statuses) == len(request_ids)
+    assert all(status < 500 for status in statuses)
+    assert errors == []
+    db.session.expire_all()
+    open_trips = dict(db.session.query(Trip.vehicle_id, db.func.count(Trip.id))
+                      .filter(Trip.end_time.is_(None)).group_by(Trip.vehicle_id).all())
+    assert sorted(open_trips.values()) == [1, 1, 1]
+    assert Request.query.filter_by(status='approved').count() == 3
+    assert Vehicle.query.filter_by(status='in_use').count() == 3
+
+
+def test_concurrent_approvals_reserve_one_window_per_vehicle(app):
+    start = datetime.now().replace(microsecond=0) + timedelta(days=1)
+    request_ids = add_requests(vehicles=2, per_vehicle=10, start_time=start, end_time=start + timedelta(hours=4))
+    statuses, errors = approve_concurrently(app, request_ids)
+
+    assert all(status < 500 for status in statuses)
+    assert errors == []
+    db.session.expire_all()
+    approved = dict(db.session.query(Request.vehicle_id, db.func.count(Request.id))
+                    .filter(Request.status == 'approved').group_by(Request.vehicle_id).all())
+    assert sorted(approved.values()) == [1, 1]
+    assert Trip.query.count() == 0
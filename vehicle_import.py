@@ -0,0 +1,186 @@
+import csv
+import io
+import unicodedata
+
+from sqlalchemy import insert, select
+
+from audit import log_events
+from events import publish_event
+from fleet_state import bump_fleet_version
+from models import db, Vehicle
+
+# Alta masiva de vehículos desde CSV o XLSX. El archivo se lee fila por fila;
+# cada lote se valida contra la base de datos con una sola consulta de placas
+# y se inserta con INSERT de varios valores junto con su evento "Creado", todo
+# en la misma transacción.
+
+IMPORT_BATCH_SIZE = 500
+
+# Encabezados aceptados (sin acentos ni mayúsculas) para cada columna
+COLUMN_ALIASES = {
+    'license_plate': ('license_plate', 'placa', 'placas'),
+    'make': ('make', 'marca'),
+    'model': ('model', 'modelo'),
+    'current_odometer': ('current_odometer', 'odometro', 'odometro inicial', 'odometro inicial (km)', 'kilometraje'),
+}
+REQUIRED_COLUMNS = ('license_plate', 'make', 'model')
+
+
+class ImportFileError(ValueError):
+    pass
+
+
+def _normalize_header(value):
+    text = unicodedata.normalize('NFKD', str(value or '')).encode('ascii', 'ignore').decode()
+    return ' '.join(text.strip().lower().split())
+
+
+def _column_positions(header):
+    names = [_normalize_header(value) for value in header]
+    positions = {}
+    for column, aliases in COLUMN_ALIASES.items():
+        for alias in aliases:
+            if alias in names:
+                positions[column] = names.index(alias)
+                break
+    missing = [column for column in REQUIRED_COLUMNS if column not in positions]
+    if missing:
+        raise ImportFileError(f"Faltan columnas en el encabezado: {', '.join(missing)}")
+    return positions
+
+
+def _iter_table(rows):
+    # Convierte filas (listas) en (número de línea, dict) según el encabezado
+    rows = iter(rows)
+    header = next(rows, None)
+    if header is None:
+        raise ImportFileError('El archivo está vacío.')
+    positions = _column_positions(header)
+    for line, values in enumerate(rows, start=2):
+        if not any(value not in (None, '') for value in values):
+            continue
+        yield line, {column: values[index] if index < len(values) else None
+                     for column, index in positions.items()}
+
+
+def iter_csv_rows(stream):
+    # utf-8-sig acepta también el BOM que agrega Excel
+    text = io.TextIOWrapper(stream, encoding='utf-8-sig', newline='')
+    sample = text.read(4096)
+    text.seek(0)
+    try:
+        dialect = csv.Sniffer().sniff(sample, delimiters=',;\t')
+    except csv.Error:
+        dialect = csv.excel
+    return _iter_table(csv.reader(text, dialect))
+
+
+def iter_xlsx_rows(stream):
+    # openpyxl es opcional; en modo read_only la hoja se recorre sin cargarla completa
+    from openpyxl import load_workbook
+
+    workbook = load_workbook(stream, read_only=True, data_only=True)
+    return _iter_table(workbook.worksheets[0].iter_rows(values_only=True))
+
+
+def iter_import_rows(stream, filename):
+    if filename.lower().endswith('.xlsx'):
+        return iter_xlsx_rows(stream)
+    if filename.lower().endswith('.csv'):
+        return iter_csv_rows(stream)
+    raise ImportFileError('El archivo debe ser .csv o .xlsx.')
+
+
+def _clean_row(row):
+    # Devuelve los valores listos para insertar o lanza ValueError con el motivo
+    plate = str(row.get('license_plate') or '').strip().upper()
+    make = str(row.get('make') or '').strip()
+    model = str(row.get('model') or '').strip()
+    if not plate:
+        raise ValueError('La placa está vacía.')
+    if len(plate) > 20:
+        raise ValueError('La placa tiene más de 20 caracteres.')
+    if not make or not model:
+        raise ValueError('La marca y el modelo son obligatorios.')
+    if len(make) > 50 or len(model) > 50:
+        raise ValueError('La marca o el modelo tienen más de 50 caracteres.')
+    odometer = row.get('current_odometer')
+    if odometer in (None, ''):
+        odometer = 0
+    else:
+        try:
+            odometer = int(float(str(odometer).strip()))
+        except ValueError:
+            raise ValueError(f'Odómetro no válido: {odometer}')
+        if odometer < 0:
+            raise ValueError('El odómetro no puede ser negativo.')
+    return {'license_plate': plate, 'make': make, 'model': model, 'current_odometer': odometer}
+
+
+def _import_batch(batch, seen, errors):
+    valid = []
+    for line, row in batch:
+        try:
+            values = _clean_row(row)
+        except ValueError as e:
+            errors.append({'line': line, 'license_plate': row.get('license_plate'), 'error': str(e)})
+            continue
+        if values['license_plate'] in seen:
+            errors.append({'line': line, 'license_plate': values['license_plate'],
+                           'error': 'La placa está repetida en el archivo.'})
+            continue
+        seen.add(values['license_plate'])
+        valid.append((line, values))
+    if not valid:
+        return 0
+
+    existing = set(db.session.scalars(
+        select(Vehicle.license_plate).where(Vehicle.license_plate.in_([values['license_plate'] for _, values in valid]))
+    ))
+    new_rows = []
+    for line, values in valid:
+        if values['license_plate'] in existing:
+            errors.append({'line': line, 'license_plate': values['license_plate'],
+                           'error': 'Ya existe un vehículo con esta placa.'})
+        else:
+            new_rows.append({**values, 'status': 'available', 'version': 1})
+    if not new_rows:
+        return 0
+
+    if db.engine.dialect.insert_returning:
+        created = db.session.execute(insert(Vehicle).returning(Vehicle.id), new_rows).scalars().all()
+    else:
+        # Sin INSERT ... RETURNING los ids se leen por placa, que es única
+        db.session.execute(insert(Vehicle), new_rows)
+        created = db.session.scalars(
+            select(Vehicle.id).where(Vehicle.license_plate.in_([row['license_plate'] for row in new_rows]))
+        ).all()
+    log_events([(vehicle_id, 'Creado', 'Vehículo añadido al sistema por importación masiva.')
+                for vehicle_id in created])
+    return len(created)
+
+
+def import_vehicles(rows, batch_size=IMPORT_BATCH_SIZE, dry_run=False):
+    # rows: iterable de (número de línea, dict). Las filas con error se omiten
+    # y se reportan; las válidas se guardan en una sola transacción.
+    errors, seen = [], set()
+    created = total = 0
+    batch = []
+    try:
+        for item in rows:
+            total += 1
+            batch.append(item)
+            if len(batch) >= batch_size:
+                created += _import_batch(batch, seen, errors)
+                batch = []
+        created += _import_batch(batch, seen, errors)
+        if dry_run or not created:
+            db.session.rollback()
+        else:
+            publish_event('vehicles_imported', count=created)
+            bump_fleet_version()
+            db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    return {'rows': total, 'created': 0 if dry_run else created, 'valid': created, 'errors': errors}